@@ -1,7 +1,14 @@
 import os
+import time
+import logging
 from flask import Flask
 
+# GUNICORN_PRELOAD=1: the gunicorn master builds the app and loads the model once before forking,
+# so the workers share the weights copy-on-write instead of each loading their own (see gunicorn.conf.py)
+GUNICORN_PRELOAD = os.getenv("GUNICORN_PRELOAD", "0") == "1"
+
 def create_app():
+    start_time = time.perf_counter()
     app = Flask(__name__)
     app.secret_key = os.getenv('SECRET_KEY')
     
@@ -11,7 +18,33 @@ def create_app():
     for folder in UPLOAD_FOLDERS:
         os.makedirs(folder, exist_ok=True)
 
+    # which model the inference routes use, and whether to load it now or on the first request
+    # (with INFERENCE_MODE=remote the model lives in the shared inference process instead)
+    from .model_registry import registry, DEFAULT_MODEL_NAME
+    from .inference import is_remote
+    app.config["MODEL_NAME"] = os.getenv("MODEL_NAME", DEFAULT_MODEL_NAME)
+    model_start = time.perf_counter()
+    if os.getenv("MODEL_EAGER_LOAD", "1") == "1" and not is_remote():
+        # in preload mode the master doesn't run torch before forking, each worker warms up after the fork
+        registry.get(app.config["MODEL_NAME"], warmup=not GUNICORN_PRELOAD)
+    model_time = time.perf_counter() - model_start
+
+    # indexes are retried from the routes if mongo isn't reachable yet
+    from .db import ensure_indexes
+    ensure_indexes()
+
+    # per-route latency histograms for /metrics
+    from . import metrics
+    metrics.init_app(app)
+
     from .routes import bp as main_bp
     app.register_blueprint(main_bp)
 
+    # how long this process took to get ready, also on /health and /metrics
+    total_time = time.perf_counter() - start_time
+    app.config["STARTUP_SECONDS"] = {"create_app": round(total_time, 3), "model_load": round(model_time, 3)}
+    metrics.APP_STARTUP.labels("create_app").observe(total_time)
+    logging.info(f"App ready in {total_time:.2f}s in process {os.getpid()} "
+                 f"(model {model_time:.2f}s, preload={GUNICORN_PRELOAD})")
+
     return app
@@ -0,0 +1,231 @@
+import os       # reading connection settings from environment variables
+import logging  # tracking when a worker opens its MongoDB connection pool
+import threading  # only one thread should create the client
+import time     # timestamps on cursor reservations
+from pymongo import MongoClient, GEOSPHERE  # connecting to MongoDB
+from pymongo.errors import PyMongoError, DuplicateKeyError, OperationFailure  # index creation can fail if mongo is down or has bad geometry
+import gridfs  # storing and retrieving the images in MongoDB
+from .metrics import MongoCommandMetrics  # counts/timings of every command for /metrics
+
+
+# Use the Docker service name when running inside Docker
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
+
+# the benchmarks point this at a throwaway database
+DATABASE_NAME = os.getenv("MONGO_DATABASE", "seniorDesignTesting")
+COLLECTION_NAME = "sendAndRecievePlantInfoTest"
+# small bookkeeping documents (like the detection collection's version counter)
+META_COLLECTION_NAME = "appMeta"
+
+# a save that reserved cursor values but never finished (worker killed mid-insert) stops holding
+# back the delta sync horizon after this long
+CURSOR_PENDING_TIMEOUT = float(os.getenv("CURSOR_PENDING_TIMEOUT", "60"))
+
+# connection pool settings (per gunicorn worker)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000"))
+
+_client = None
+_client_pid = None
+_fs = None
+_lock = threading.Lock()
+_indexes_ready = False
+_index_results = {}  # index name -> True (exists) / False (failed on the data, not retried)
+_index_lock = threading.Lock()
+_index_retry_at = 0.0
+
+# how long to wait before trying again when MongoDB couldn't be reached for index creation
+INDEX_RETRY_SECONDS = float(os.getenv("INDEX_RETRY_SECONDS", "30"))
+
+
+def get_client():
+    """
+    Returns this process's shared MongoClient, creating it on first use.
+    MongoClient isn't fork-safe, so a gunicorn worker that inherited one from the master makes its own.
+    """
+    global _client, _client_pid, _fs
+    if _client is not None and _client_pid == os.getpid():
+        return _client
+
+    with _lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = MongoClient(
+                MONGO_URI,
+                maxPoolSize=MONGO_MAX_POOL_SIZE,
+                minPoolSize=MONGO_MIN_POOL_SIZE,
+                serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+                connect=False,  # open sockets on first operation, after any fork
+                event_listeners=[MongoCommandMetrics()],
+            )
+            _client_pid = os.getpid()
+            _fs = None
+            logging.info(f"Created MongoDB client for process {_client_pid} (maxPoolSize={MONGO_MAX_POOL_SIZE})")
+    return _client
+
+
+def get_db():
+    return get_client()[DATABASE_NAME]
+
+
+def get_collection():
+    return get_db()[COLLECTION_NAME]
+
+
+def get_fs():
+    """GridFS bucket on the shared client."""
+    global _fs
+    db = get_db()
+    if _fs is None:
+        _fs = gridfs.GridFS(db)
+    return _fs
+
+
+def get_collection_version():
+    """
+    Version string for the detection collection, shared by all workers.
+    The counter is bumped by save_results, the document count catches inserts/deletes from the scripts.
+    """
+    meta = get_db()[META_COLLECTION_NAME].find_one({"_id": COLLECTION_NAME}, {"version": 1})
+    counter = meta.get("version", 0) if meta else 0
+    return f"{counter}.{get_collection().estimated_document_count()}"
+
+
+def bump_collection_version():
+    get_db()[META_COLLECTION_NAME].update_one({"_id": COLLECTION_NAME}, {"$inc": {"version": 1}}, upsert=True)
+
+
+def reserve_cursor_range(count, db=None):
+    """
+    Reserves count consecutive insertion cursor values for new detection documents and returns the first.
+    The range stays "pending" on the meta document until release_cursor_range, so /images?since= never
+    hands out a cursor past documents that are still being inserted. Every path that inserts detection
+    documents has to do this (scripts with their own client pass their database as db).
+    """
+    meta = (db if db is not None else get_db())[META_COLLECTION_NAME]
+    while True:
+        doc = meta.find_one({"_id": COLLECTION_NAME}, {"cursor": 1}) or {}
+        current = doc.get("cursor", 0)
+        # compare-and-set so the start we record as pending is exactly the one we got
+        try:
+            result = meta.update_one(
+                {"_id": COLLECTION_NAME, "cursor": current} if "cursor" in doc else
+                {"_id": COLLECTION_NAME, "cursor": {"$exists": False}},
+                {"$set": {"cursor": current + count}, "$push": {"pending": {"start": current + 1, "at": time.time()}}},
+                upsert=not doc,
+            )
+        except DuplicateKeyError:
+            continue  # another save created the meta document first
+        if result.matched_count or result.upserted_id is not None:
+            return current + 1
+
+
+def release_cursor_range(start, db=None):
+    """Marks a reserved range as inserted and bumps the collection version (cached /images responses are stale)."""
+    stale_before = time.time() - CURSOR_PENDING_TIMEOUT
+    (db if db is not None else get_db())[META_COLLECTION_NAME].update_one(
+        {"_id": COLLECTION_NAME},
+        {"$pull": {"pending": {"$or": [{"start": start}, {"at": {"$lt": stale_before}}]}}, "$inc": {"version": 1}},
+    )
+
+
+def cursor_state():
+    """
+    (horizon, last) for delta sync: every document with seq <= horizon is already visible,
+    last is the highest value handed out so far.
+    """
+    doc = get_db()[META_COLLECTION_NAME].find_one({"_id": COLLECTION_NAME}, {"cursor": 1, "pending": 1}) or {}
+    last = doc.get("cursor", 0)
+    fresh_after = time.time() - CURSOR_PENDING_TIMEOUT
+    pending = [p["start"] for p in doc.get("pending", []) if p.get("at", 0) >= fresh_after]
+    return (min(pending) - 1 if pending else last), last
+
+
+def _create_geometry_index():
+    try:
+        get_collection().create_index([("geometry", GEOSPHERE)], name="geometry_2dsphere")
+    except OperationFailure:
+        # documents saved before positions were checked have null coordinates
+        logging.error("The 2dsphere index was rejected, documents with null coordinates can be fixed "
+                      "with 'python -m app.migrate_geometry'")
+        raise
+
+
+def _index_builders():
+    """(name, function creating it) for every index the routes rely on."""
+    from .stats import ensure_stats_indexes
+    from .jobs import ensure_job_indexes
+    db = get_db()
+    return [
+        # spatial index for bbox queries on /images
+        ("geometry_2dsphere", _create_geometry_index),
+        # /images?since= delta sync reads documents by insertion cursor
+        ("seq", lambda: get_collection().create_index("seq", name="seq")),
+        # thumbnails/previews are looked up by the original image's id, one copy per size
+        ("derivative_of_size", lambda: db["fs.files"].create_index(
+            [("metadata.derivative_of", 1), ("metadata.size", 1)], name="derivative_of_size", unique=True,
+            partialFilterExpression={"metadata.derivative_of": {"$exists": True}})),
+        # one GridFS copy per image content (older files without a hash are left out)
+        ("sha256_unique", lambda: db["fs.files"].create_index(
+            "metadata.sha256", name="sha256_unique", unique=True,
+            partialFilterExpression={"metadata.sha256": {"$exists": True}})),
+        # /stats reads the per-cell aggregates by precision, cell and day
+        ("stats", lambda: ensure_stats_indexes(db)),
+        # old inference jobs clean themselves up, their results are read per job in order
+        ("jobs", lambda: ensure_job_indexes(db)),
+    ]
+
+
+def ensure_indexes():
+    """
+    Creates the indexes the routes rely on, each on its own so one failing doesn't block the others.
+    An index MongoDB rejects because of the stored data is logged once and not retried; when MongoDB
+    can't be reached, the next try is at most every INDEX_RETRY_SECONDS. Cheap to call on every request.
+    """
+    global _indexes_ready, _index_retry_at
+    if _indexes_ready or time.monotonic() < _index_retry_at:
+        return _indexes_ready and all(_index_results.values())
+    if not _index_lock.acquire(blocking=False):
+        return False  # another thread is creating them, don't hold this request up
+    try:
+        unreachable = False
+        for name, create in _index_builders():
+            if name in _index_results:
+                continue
+            try:
+                create()
+                _index_results[name] = True
+            except OperationFailure as e:
+                _index_results[name] = False
+                logging.error(f"Could not create MongoDB index {name}, not retrying until restart: {e}")
+            except PyMongoError as e:
+                # MongoDB can't be reached, the other builders would only wait out the same timeout
+                unreachable = True
+                logging.warning(f"Could not create MongoDB index {name} yet: {e}")
+                break
+        if unreachable:
+            _index_retry_at = time.monotonic() + INDEX_RETRY_SECONDS
+            return False
+        _indexes_ready = True
+        return all(_index_results.values())
+    finally:
+        _index_lock.release()
+
+
+def ping():
+    """Health check, only used by /health so requests don't pay for it."""
+    get_client().admin.command("ping")
+
+
+def close_client():
+    global _client, _client_pid, _fs
+    with _lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+        _fs = None
@@ -0,0 +1,131 @@
+import os       # settings from environment variables
+import sys      # command line arguments for the backfill
+import logging  # reporting derivative generation problems
+from io import BytesIO  # in-memory streams for PIL
+from concurrent.futures import ThreadPoolExecutor  # background derivative generation
+from PIL import Image, ImageOps  # resizing images
+from bson import ObjectId  # derivative ids are picked before writing
+from gridfs.errors import FileExists  # another thread stored the same derivative first
+from pymongo.errors import DuplicateKeyError  # the unique derivative index rejected a second copy
+from .db import get_db, get_fs  # GridFS on the shared client
+
+
+# name -> longest side in pixels
+DERIVATIVE_SIZES = {
+    "thumb": 256,
+    "medium": 1024,
+}
+DERIVATIVE_JPEG_QUALITY = int(os.getenv("DERIVATIVE_JPEG_QUALITY", "80"))
+
+# generating derivatives happens off the request thread
+derivative_executor = ThreadPoolExecutor(max_workers=int(os.getenv("DERIVATIVE_WORKERS", "2")),
+                                         thread_name_prefix="derivatives")
+
+
+def make_derivative(image_bytes, max_side):
+    """Returns JPEG bytes of the image scaled so its longest side is max_side."""
+    image = Image.open(BytesIO(image_bytes))
+    # let the JPEG decoder downscale while decoding (much faster than decoding the full 20 MP frame)
+    image.draft("RGB", (max_side, max_side))
+    # the derivative has no EXIF, so bake the orientation into the pixels like the browser would show it
+    image = ImageOps.exif_transpose(image)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    output = BytesIO()
+    image.save(output, format="JPEG", quality=DERIVATIVE_JPEG_QUALITY, optimize=True)
+    return output.getvalue()
+
+
+def find_derivative(file_id, size):
+    """Returns the GridOut for the stored derivative, or None if it hasn't been made yet."""
+    return get_fs().find_one({"metadata.derivative_of": file_id, "metadata.size": size})
+
+
+def store_derivative(file_id, size, image_bytes, filename=None):
+    """
+    Stores one derivative and returns its id. The unique derivative_of/size index keeps a single copy
+    when the background job and an on-demand request make the same one, the loser returns the winner's id.
+    """
+    data = make_derivative(image_bytes, DERIVATIVE_SIZES[size])
+    derivative_id = ObjectId()
+    try:
+        return get_fs().put(
+            data,
+            _id=derivative_id,
+            filename=f"{filename or file_id}.{size}.jpg",
+            contentType="image/jpeg",
+            metadata={"derivative_of": file_id, "size": size},
+        )
+    except (FileExists, DuplicateKeyError):
+        get_db()["fs.chunks"].delete_many({"files_id": derivative_id})
+        existing = find_derivative(file_id, size)
+        if existing is None:
+            raise
+        return existing._id
+
+
+def generate_derivatives(file_id, image_bytes, filename=None):
+    """Makes every missing derivative for one original image."""
+    for size in DERIVATIVE_SIZES:
+        try:
+            if find_derivative(file_id, size) is None:
+                store_derivative(file_id, size, image_bytes, filename)
+        except Exception as e:
+            logging.error(f"Could not make {size} derivative for {file_id}: {e}")
+
+
+def schedule_derivatives(file_id, image_bytes, filename=None):
+    """Queues derivative generation for a new upload in the background."""
+    return derivative_executor.submit(generate_derivatives, file_id, image_bytes, filename)
+
+
+def schedule_after_upload(upload_future, image_bytes, filename=None):
+    """
+    Queues derivatives once the GridFS upload finished, for the id it actually ended up under
+    (an identical image stored at the same time wins and the upload resolves to that one).
+    """
+    def schedule(future):
+        if future.exception() is None:
+            schedule_derivatives(future.result(), image_bytes, filename)
+    upload_future.add_done_callback(schedule)
+
+
+def get_or_create_derivative(file_id, size):
+    """Returns the derivative's GridOut, making it from the original right now if it's missing."""
+    derivative = find_derivative(file_id, size)
+    if derivative is not None:
+        return derivative
+    original = get_fs().get(file_id)
+    derivative_id = store_derivative(file_id, size, original.read(), original.filename)
+    return get_fs().get(derivative_id)
+
+
+def backfill():
+    """Makes derivatives for every original image in GridFS that doesn't have them yet."""
+    fs = get_fs()
+    done = 0
+    for original in fs.find({"metadata.derivative_of": {"$exists": False}}, no_cursor_timeout=True):
+        missing = [size for size in DERIVATIVE_SIZES if find_derivative(original._id, size) is None]
+        if not missing:
+            continue
+        image_bytes = original.read()
+        for size in missing:
+            try:
+                store_derivative(original._id, size, image_bytes, original.filename)
+            except Exception as e:
+                logging.error(f"Could not make {size} derivative for {original._id}: {e}")
+        done += 1
+        if done % 100 == 0:
+            logging.info(f"Backfilled derivatives for {done} images")
+    logging.info(f"Backfill finished, made derivatives for {done} images")
+
+
+if __name__ == "__main__":
+    # python -m app.derivatives --backfill
+    logging.basicConfig(level=logging.INFO)
+    if "--backfill" in sys.argv:
+        backfill()
+    else:
+        print("usage: python -m app.derivatives --backfill")
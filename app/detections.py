@@ -0,0 +1,110 @@
+import os       # storage settings from environment variables
+import struct   # packing probabilities into a few bytes
+from bson import Binary, ObjectId  # packed probabilities and file references
+from bson.errors import InvalidId  # legacy documents with a bad file_id string
+
+
+# Compact layout of a detection document (schema 2):
+#   {_id, schema: 2, seq, file_id: ObjectId, filename, class, conf, probs: Binary,
+#    geometry: {type: "Point", coordinates: [lon, lat]}, yaw, msl_alt}
+# Coordinates are only stored once (geometry, which the 2dsphere index needs), fields we don't
+# know (no GPS, no yaw) are left out instead of stored as null/"Unknown", and the probability
+# vector is packed little-endian floats. Older documents (schema 1) are the nested GeoJSON
+# Features with everything under "properties"; python -m app.migrate_detections converts them.
+SCHEMA_VERSION = 2
+
+# float16 keeps ~3 significant digits, plenty for a softmax we display with 4 decimals
+PROBABILITY_DTYPE = os.getenv("PROBABILITY_DTYPE", "float16")
+
+# the Binary subtype records how the vector was packed (128+ are user-defined subtypes)
+_PACK_FORMATS = {"float16": ("e", 128), "float32": ("f", 129)}
+_UNPACK_FORMATS = {subtype: code for code, subtype in _PACK_FORMATS.values()}
+
+
+def pack_probabilities(probabilities, dtype=PROBABILITY_DTYPE):
+    code, subtype = _PACK_FORMATS[dtype]
+    return Binary(struct.pack(f"<{len(probabilities)}{code}", *probabilities), subtype)
+
+
+def unpack_probabilities(packed):
+    """List of floats from a packed vector (rounded, the extra float16 digits are noise)."""
+    code = _UNPACK_FORMATS[packed.subtype]
+    count = len(packed) // struct.calcsize(code)
+    return [round(p, 4) for p in struct.unpack(f"<{count}{code}", packed)]
+
+
+def _number(value):
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+def build_document(file_id, filename, lat, lon, yaw=None, msl_alt=None, predicted_class=None, probabilities=None):
+    """A schema 2 detection document (seq is added by save_results when it is inserted)."""
+    doc = {
+        "schema": SCHEMA_VERSION,
+        "file_id": file_id,
+        "filename": filename,
+    }
+    if predicted_class is not None:
+        doc["class"] = predicted_class
+    if probabilities:
+        doc["conf"] = float(max(probabilities))  # top-1 confidence, stored plainly so it can be queried
+        doc["probs"] = pack_probabilities(probabilities)
+    if lat is not None and lon is not None:
+        doc["geometry"] = {"type": "Point", "coordinates": [lon, lat]}
+    if _number(yaw) is not None:
+        doc["yaw"] = _number(yaw)
+    if _number(msl_alt) is not None:
+        doc["msl_alt"] = _number(msl_alt)
+    return doc
+
+
+# properties of schema 1 documents that have a schema 2 field, anything else is kept under "extra"
+_LEGACY_PROPERTIES = {"filename", "lat", "lon", "yaw", "msl_alt", "predicted_class", "probabilities", "file_id"}
+# top-level fields of schema 1 documents that are rebuilt, anything else is copied as it is
+_LEGACY_FIELDS = {"_id", "type", "properties", "geometry", "schema"}
+
+
+def from_legacy(doc):
+    """
+    Converts a schema 1 document (GeoJSON Feature with properties) to schema 2, keeping _id, seq and
+    every field it has no place for (unknown properties under "extra", other top-level fields as they are),
+    so nothing stored in the old document is lost.
+    """
+    properties = doc.get("properties") or {}
+    file_id = properties.get("file_id")
+    try:
+        file_id = ObjectId(file_id) if file_id is not None else None
+    except (InvalidId, TypeError):
+        pass  # keep whatever was there rather than lose the reference
+    compact = build_document(
+        file_id,
+        properties.get("filename"),
+        properties.get("lat"),
+        properties.get("lon"),
+        yaw=properties.get("yaw"),
+        msl_alt=properties.get("msl_alt"),
+        predicted_class=properties.get("predicted_class"),
+        probabilities=properties.get("probabilities"),
+    )
+    compact["_id"] = doc["_id"]
+    extra = {key: value for key, value in properties.items() if key not in _LEGACY_PROPERTIES}
+    if extra:
+        compact["extra"] = extra
+    for key, value in doc.items():
+        if key not in _LEGACY_FIELDS and key not in compact:
+            compact[key] = value  # seq, and whatever older scripts stored next to properties
+    return compact
+
+
+def inline_image(doc):
+    """Image bytes stored inside a schema 1 document (legacy ingest / old upload route), or None."""
+    properties = doc.get("properties") or {}
+    if properties.get("image_data_binary") is not None:
+        return bytes(properties["image_data_binary"])
+    if doc.get("image_data") is not None:
+        return bytes(doc["image_data"])
+    return None
+
+
+def is_compact(doc):
+    return doc.get("schema") == SCHEMA_VERSION
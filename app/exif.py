@@ -0,0 +1,62 @@
+import logging  # reporting EXIF parsing problems
+from io import BytesIO  # in-memory streams for exifread
+
+
+# The EXIF block lives in the JPEG's APP1 segment, which can't be bigger than 64 KB and sits
+# near the start of the file, so this many bytes is always enough (one default GridFS chunk)
+EXIF_HEADER_BYTES = 255 * 1024
+
+
+def convert_to_degrees(value, ref_tag):
+    """
+    Converts the GPS coordinates stored in the EXIF to degrees in float format.
+    :param value: EXIF GPS coordinate value.
+    :param ref_tag: EXIF GPS reference tag (e.g., 'N', 'S', 'E', 'W').
+    :return: GPS coordinate in degrees (float) or None if conversion fails.
+    """
+    try:
+        d = value.values[0].num / value.values[0].den
+        m = value.values[1].num / value.values[1].den
+        s = value.values[2].num / value.values[2].den
+        result = d + (m / 60.0) + (s / 3600.0)
+        if ref_tag and ref_tag.values[0] in ['S', 'W']:
+            result = -result
+        return result
+    except Exception as e:
+        logging.error(f"Error converting GPS value: {e}")
+        return None
+
+
+def extract_metadata(header_bytes):
+    """
+    Reads GPS position, yaw and altitude from the start of a JPEG.
+    Returns raw values (no drone offsets applied) as {"lat", "lon", "yaw", "msl_alt"}.
+    """
+    import exifread  # reading EXIF data from images, only needed on the upload/save paths
+    tags = exifread.process_file(BytesIO(header_bytes[:EXIF_HEADER_BYTES]), details=False)
+
+    # Extract GPS data
+    lat, lon = None, None
+    if 'GPS GPSLatitude' in tags and 'GPS GPSLongitude' in tags:
+        lat = convert_to_degrees(tags['GPS GPSLatitude'], tags.get('GPS GPSLatitudeRef'))
+        lon = convert_to_degrees(tags['GPS GPSLongitude'], tags.get('GPS GPSLongitudeRef'))
+
+    # Extract image direction (yaw) if available
+    yaw = "Unknown"
+    if 'GPS GPSImgDirection' in tags:
+        try:
+            direction = tags['GPS GPSImgDirection'].values[0]
+            yaw = float(direction.num) / float(direction.den)
+        except Exception:
+            yaw = "Unknown"
+
+    # Extract altitude (meters) if available
+    altitude_meters = None
+    if 'GPS GPSAltitude' in tags:
+        try:
+            altitude = tags['GPS GPSAltitude'].values[0]
+            altitude_meters = float(altitude.num) / float(altitude.den)
+        except Exception:
+            altitude_meters = None
+
+    return {"lat": lat, "lon": lon, "yaw": yaw, "msl_alt": altitude_meters}
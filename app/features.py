@@ -0,0 +1,164 @@
+import os       # reading output settings from environment variables
+import json     # fallback JSON encoder
+import zlib     # gzip-compressing the stream as it is produced
+from .detections import SCHEMA_VERSION, unpack_probabilities  # compact (schema 2) detection documents
+
+try:
+    import orjson  # much faster JSON encoder, used when installed
+except ImportError:
+    orjson = None
+
+
+# only the fields /images sends to the map are pulled from MongoDB (both document layouts)
+FEATURE_PROJECTION = {
+    "_id": 1,
+    "schema": 1,
+    "file_id": 1,
+    "filename": 1,
+    "class": 1,
+    "probs": 1,
+    "geometry.coordinates": 1,
+    "yaw": 1,
+    "msl_alt": 1,
+    "extra.agl": 1,
+    "extra.agl_feet": 1,
+    "properties.filename": 1,
+    "properties.lat": 1,
+    "properties.lon": 1,
+    "properties.yaw": 1,
+    "properties.msl_alt": 1,
+    "properties.agl": 1,
+    "properties.agl_feet": 1,
+    "properties.predicted_class": 1,
+    "properties.probabilities": 1,
+    "properties.file_id": 1,
+}
+
+# bytes collected before a chunk is sent, so we don't write one tiny chunk per feature
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", str(64 * 1024)))
+CURSOR_BATCH_SIZE = int(os.getenv("CURSOR_BATCH_SIZE", "1000"))
+
+
+def dumps(obj):
+    """Serializes obj to JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str)
+    return json.dumps(obj, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def feature_from_doc(doc):
+    """Builds the GeoJSON Feature the map expects from a stored detection document."""
+    if doc.get("schema") == SCHEMA_VERSION:
+        return feature_from_compact(doc)
+    # Access the 'properties' dictionary correctly
+    properties = doc.get("properties", {})
+    return {
+        "type": "Feature",
+        "properties": {
+            # Convert ObjectId to string so that mapbox had a marker id for the point for clustering
+            "_id": str(doc["_id"]),
+            "filename": properties.get("filename"),
+            "lat": properties.get("lat"),
+            "lon": properties.get("lon"),
+            "yaw": properties.get("yaw"),
+            "msl_alt": properties.get("msl_alt"),
+            "agl": properties.get("agl", "undefined"),
+            "agl_feet": properties.get("agl_feet", "undefined"),
+            "predicted_class": properties.get("predicted_class"),
+            "probabilities": properties.get("probabilities"),
+            "file_id": properties.get("file_id")  # the id where the image is being stored
+        },
+        "geometry": {
+            "type": "Point",
+            "coordinates": [properties.get("lon"), properties.get("lat")]
+        }
+    }
+
+
+def feature_from_compact(doc):
+    """Same Feature as feature_from_doc, from a schema 2 document."""
+    lon, lat = doc["geometry"]["coordinates"] if "geometry" in doc else (None, None)
+    extra = doc.get("extra") or {}
+    return {
+        "type": "Feature",
+        "properties": {
+            "_id": str(doc["_id"]),
+            "filename": doc.get("filename"),
+            "lat": lat,
+            "lon": lon,
+            "yaw": doc.get("yaw", "Unknown"),
+            "msl_alt": doc.get("msl_alt"),
+            "agl": extra.get("agl", "undefined"),
+            "agl_feet": extra.get("agl_feet", "undefined"),
+            "predicted_class": doc.get("class"),
+            "probabilities": unpack_probabilities(doc["probs"]) if "probs" in doc else None,
+            "file_id": str(doc["file_id"]) if doc.get("file_id") is not None else None,
+        },
+        "geometry": {
+            "type": "Point",
+            "coordinates": [lon, lat]
+        }
+    }
+
+
+def _json_number(value):
+    return b"null" if value is None else repr(float(value)).encode("ascii")
+
+
+def feature_json(doc):
+    """
+    The encoded Feature for /images. Schema 2 documents are written straight into the JSON
+    bytes without building the nested dicts first; older documents go through feature_from_doc.
+    """
+    if doc.get("schema") != SCHEMA_VERSION or doc.get("extra"):
+        # older documents, and migrated ones that kept their agl values
+        return dumps(feature_from_doc(doc))
+    lon, lat = doc["geometry"]["coordinates"] if "geometry" in doc else (None, None)
+    yaw = doc.get("yaw")
+    probabilities = unpack_probabilities(doc["probs"]) if "probs" in doc else None
+    file_id = doc.get("file_id")
+    lon, lat = _json_number(lon), _json_number(lat)
+    return b"".join((
+        b'{"type":"Feature","properties":{"_id":"', str(doc["_id"]).encode("ascii"),
+        b'","filename":', dumps(doc.get("filename")),
+        b',"lat":', lat, b',"lon":', lon,
+        b',"yaw":', b'"Unknown"' if yaw is None else _json_number(yaw),
+        b',"msl_alt":', _json_number(doc.get("msl_alt")),
+        b',"agl":"undefined","agl_feet":"undefined","predicted_class":', dumps(doc.get("class")),
+        b',"probabilities":', dumps(probabilities),
+        b',"file_id":', dumps(str(file_id) if file_id is not None else None),
+        b'},"geometry":{"type":"Point","coordinates":[', lon, b",", lat, b"]}}",
+    ))
+
+
+def iter_feature_collection(features, extra=None):
+    """
+    Yields a GeoJSON FeatureCollection as JSON byte chunks, one feature at a time,
+    so the whole collection never has to sit in memory. extra adds top-level keys.
+    Features can be dicts or already-encoded JSON bytes (feature_json).
+    """
+    buffer = bytearray(b'{"type":"FeatureCollection",')
+    for key, value in (extra or {}).items():
+        buffer += dumps(key) + b":" + dumps(value) + b","
+    buffer += b'"features":['
+    first = True
+    for feature in features:
+        if not first:
+            buffer += b","
+        buffer += feature if isinstance(feature, bytes) else dumps(feature)
+        first = False
+        if len(buffer) >= STREAM_CHUNK_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += b"]}"
+    yield bytes(buffer)
+
+
+def gzip_chunks(chunks, level=6):
+    """Gzip-compresses a stream of byte chunks on the fly."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31 = gzip header
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
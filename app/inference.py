@@ -0,0 +1,154 @@
+import os       # inference settings from environment variables
+import time     # timing forward passes
+import logging  # reporting when the inference process can't be asked about a model
+from .model_registry import registry  # loaded models are cached here instead of reloaded per request
+from . import inference_scheduler  # batches single images from concurrent requests together
+from .metrics import INFERENCE_BATCH_SIZE, INFERENCE_BATCH_LATENCY  # batch stats for /metrics
+
+
+# "local": every gunicorn worker loads its own model copy
+# "remote": workers send images to the one shared inference process (python -m app.inference_server)
+INFERENCE_MODE = os.getenv("INFERENCE_MODE", "local")
+
+# when on, single-image requests go through the cross-request micro-batching scheduler
+USE_INFERENCE_SCHEDULER = os.getenv("USE_INFERENCE_SCHEDULER", "1") == "1"
+
+
+def is_remote():
+    return INFERENCE_MODE == "remote"
+
+
+def prediction_from_result(result):
+    """Pulls the class, probabilities and index out of one YOLO classification result."""
+    top_index = result.probs.top1  # Get top prediction index
+    return {
+        "predicted_class": result.names[top_index],  # Get class name
+        "probabilities": result.probs.data.tolist(),  # Get probabilities
+        "top_index": top_index,
+    }
+
+
+def serving_backend(model_name):
+    """Backend actually serving the model (an export that failed validation falls back to pytorch)."""
+    if is_remote():
+        info = remote_model_info(model_name)
+        if info and info.get("backend"):
+            return info["backend"]
+        from .model_export import MODEL_BACKEND
+        return MODEL_BACKEND
+    backend = registry.backend(model_name)
+    if backend is None:
+        registry.get(model_name)  # predictions need it loaded anyway
+        backend = registry.backend(model_name)
+    return backend
+
+
+def model_version(model_name):
+    """
+    Key for cached predictions: exported/quantized backends can give slightly different
+    probabilities than the .pt, so they get their own cache entries.
+    """
+    backend = serving_backend(model_name)
+    return model_name if backend == "pytorch" else f"{model_name}/{backend}"
+
+
+_remote_model_info = {}  # name -> {"imgsz", "backend"} of the model loaded in the inference process
+
+
+def remote_model_info(model_name):
+    """Input size and backend of a model in the inference process (asked once per worker), None if unreachable."""
+    info = _remote_model_info.get(model_name)
+    if info is None:
+        from .inference_client import client
+        try:
+            info = _remote_model_info[model_name] = client.model_info(model_name)
+        except Exception as e:
+            logging.warning(f"Could not get model info for '{model_name}' from the inference process: {e}")
+    return info
+
+
+def input_size(model_name):
+    """
+    Square input size of the model. In remote mode the inference process reports it, so workers
+    decode at the size the model will actually use; PREPROCESS_SIZE is only the last resort.
+    """
+    from .preprocess import PREPROCESS_SIZE
+    if is_remote():
+        info = remote_model_info(model_name)
+        if info and info.get("imgsz"):
+            return info["imgsz"]
+    return registry.imgsz(model_name) or PREPROCESS_SIZE
+
+
+def predict_local(model_name, images):
+    """Runs BGR images through the model loaded in this process, returns one prediction dict per image."""
+    # OpenCV/NumPy only get imported by processes that actually run the model
+    from .preprocess import preprocessor
+    model = registry.get(model_name)
+    size = registry.imgsz(model_name)
+    start_time = time.perf_counter()
+    if size and size % 32 == 0:
+        import torch
+        # our own preprocessing matches the classify transforms, so the model gets a ready tensor
+        with preprocessor.to_batch(images, size) as batch:
+            results = model.predict(torch.from_numpy(batch), verbose=False)
+    else:
+        results = model.predict(images, verbose=False)
+    INFERENCE_BATCH_LATENCY.labels(model_name).observe(time.perf_counter() - start_time)
+    INFERENCE_BATCH_SIZE.labels(model_name).observe(len(images))
+    return [prediction_from_result(result) for result in results]
+
+
+def predict_tiles_local(model_name, tiles):
+    """
+    Runs a (rows, cols, 3, size, size) tile view through the model in one pass.
+    Returns {"names": class names, "probabilities": one list per tile}.
+    """
+    import torch
+    from .preprocess import preprocessor
+    model = registry.get(model_name)
+    start_time = time.perf_counter()
+    with preprocessor.tiles_to_batch(tiles) as batch:
+        results = model.predict(torch.from_numpy(batch), verbose=False)
+    INFERENCE_BATCH_LATENCY.labels(model_name).observe(time.perf_counter() - start_time)
+    INFERENCE_BATCH_SIZE.labels(model_name).observe(len(results))
+    names = results[0].names if results else model.names
+    return {
+        "names": [names[i] for i in range(len(names))],
+        "probabilities": [result.probs.data.tolist() for result in results],
+    }
+
+
+def predict_tiles(model_name, tiles):
+    """Tiled (sliding-window) prediction, see app/tiling.py."""
+    if is_remote():
+        from .inference_client import client
+        return client.predict_tiles(model_name, tiles)
+    return predict_tiles_local(model_name, tiles)
+
+
+def check_model(model_name):
+    """Raises KeyError if no model is registered under model_name (without loading it in remote mode)."""
+    if model_name not in registry.names():
+        raise KeyError(f"No model registered under name '{model_name}'")
+    if not is_remote():
+        registry.get(model_name)
+
+
+def predict_images(model_name, images):
+    """Runs a batch of BGR images through the model, returns one prediction dict per image."""
+    if is_remote():
+        from .inference_client import client
+        return client.predict(model_name, images)
+    return predict_local(model_name, images)
+
+
+def predict_image(model_name, image):
+    """Prediction for one image, batched together with other requests' images when the scheduler is on."""
+    if is_remote():
+        # the inference process batches requests from all workers itself
+        return predict_images(model_name, [image])[0]
+    if USE_INFERENCE_SCHEDULER:
+        scheduler = inference_scheduler.get_scheduler(model_name, lambda images: predict_local(model_name, images))
+        return scheduler.predict(image)
+    return predict_images(model_name, [image])[0]
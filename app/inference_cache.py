@@ -0,0 +1,67 @@
+import threading  # request threads share the hit/miss counters
+from pymongo import UpdateOne  # bulk upserts of new predictions
+from .db import get_db  # database on the shared client
+from .metrics import INFERENCE_CACHE_LOOKUPS  # hit/miss counters summed over all workers
+
+
+# predictions keyed by (image content hash, model name), so a re-uploaded frame skips the model
+INFERENCE_CACHE_COLLECTION = "inferenceCache"
+
+_lock = threading.Lock()
+_hits = 0
+_misses = 0
+
+
+def _key(sha256, model_name):
+    return f"{sha256}:{model_name}"
+
+
+def lookup_many(hashes, model_name):
+    """
+    Returns {sha256: prediction} for every hash that already has a stored prediction from this model
+    (tiled predictions come back with their per-tile heatmap).
+    """
+    global _hits, _misses
+    unique = set(hashes)
+    found = {}
+    if unique:
+        docs = get_db()[INFERENCE_CACHE_COLLECTION].find(
+            {"_id": {"$in": [_key(h, model_name) for h in unique]}},
+            {"sha256": 1, "predicted_class": 1, "probabilities": 1, "top_index": 1, "tiles": 1},
+        )
+        for doc in docs:
+            found[doc["sha256"]] = {
+                "predicted_class": doc["predicted_class"],
+                "probabilities": doc["probabilities"],
+                "top_index": doc["top_index"],
+            }
+            if "tiles" in doc:
+                found[doc["sha256"]]["tiles"] = doc["tiles"]
+    hits = sum(1 for h in hashes if h in found)
+    with _lock:
+        _hits += hits
+        _misses += len(hashes) - hits
+    INFERENCE_CACHE_LOOKUPS.labels("hit").inc(hits)
+    INFERENCE_CACHE_LOOKUPS.labels("miss").inc(len(hashes) - hits)
+    return found
+
+
+def store_many(predictions, model_name):
+    """Saves {sha256: prediction} for later lookups."""
+    if not predictions:
+        return
+    requests = [
+        UpdateOne(
+            {"_id": _key(sha256, model_name)},
+            {"$setOnInsert": {"sha256": sha256, "model": model_name, **prediction}},
+            upsert=True,
+        )
+        for sha256, prediction in predictions.items()
+    ]
+    get_db()[INFERENCE_CACHE_COLLECTION].bulk_write(requests, ordered=False)
+
+
+def stats():
+    with _lock:
+        total = _hits + _misses
+        return {"hits": _hits, "misses": _misses, "hit_rate": round(_hits / total, 4) if total else 0}
@@ -0,0 +1,80 @@
+import os       # socket settings from environment variables
+import threading  # one connection per request thread
+from multiprocessing.connection import Client  # local socket to the inference process
+
+
+INFERENCE_SOCKET = os.getenv("INFERENCE_SOCKET", "/tmp/inference.sock")
+# shared secret of this deployment, gunicorn.conf.py generates a random one for its workers and inference process
+INFERENCE_AUTHKEY = os.getenv("INFERENCE_AUTHKEY", "").encode("utf-8")
+# longest a web thread waits for an answer (a big tiled/batch request on CPU included)
+INFERENCE_TIMEOUT_SECONDS = float(os.getenv("INFERENCE_TIMEOUT_SECONDS", "120"))
+
+
+class InferenceClient:
+    """Talks to the shared inference process over a local Unix socket."""
+
+    def __init__(self, address=INFERENCE_SOCKET, authkey=INFERENCE_AUTHKEY, timeout=INFERENCE_TIMEOUT_SECONDS):
+        self.address = address
+        self.authkey = authkey
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        # connections can't be shared between threads or survive a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            if not self.authkey:
+                raise RuntimeError("INFERENCE_AUTHKEY is not set (gunicorn.conf.py sets it in remote mode)")
+            conn = Client(self.address, family="AF_UNIX", authkey=self.authkey)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _drop_connection(self):
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+    def request(self, message):
+        # retry once with a fresh connection in case the inference process restarted
+        for attempt in range(2):
+            try:
+                conn = self._connection()
+                conn.send(message)
+                if not conn.poll(self.timeout):
+                    # a late answer would be read by the next request on this connection, so drop it
+                    self._drop_connection()
+                    raise TimeoutError(f"No answer from the inference process within {self.timeout:.0f}s")
+                status, payload = conn.recv()
+                break
+            except TimeoutError:
+                raise  # a hung process won't answer a retry either
+            except (OSError, EOFError):
+                self._drop_connection()
+                if attempt == 1:
+                    raise
+        if status != "ok":
+            raise RuntimeError(f"Inference process error: {payload}")
+        return payload
+
+    def predict(self, model_name, images):
+        """One prediction dict per image."""
+        return self.request(("predict", model_name, list(images)))
+
+    def predict_tiles(self, model_name, tiles):
+        """Tile probabilities for one image's tile grid (already a whole batch, so it skips the scheduler)."""
+        return self.request(("predict_tiles", model_name, tiles))
+
+    def model_info(self, model_name):
+        """{"imgsz", "backend"} of the model as loaded in the inference process."""
+        return self.request(("model_info", model_name))
+
+    def stats(self):
+        return self.request(("stats",))
+
+
+client = InferenceClient()
@@ -0,0 +1,132 @@
+import os       # reading scheduler settings from environment variables
+import logging  # reporting failed batches
+import queue    # thread-safe queue the request threads put images on
+import threading  # background thread that runs the batches
+import time     # measuring how long requests wait and batches take
+from collections import Counter  # counting how often each batch size happens
+from concurrent.futures import Future  # each request waits on one of these for its result
+from .metrics import INFERENCE_QUEUE_WAIT  # queue wait histogram for /metrics
+
+
+SCHEDULER_MAX_BATCH_SIZE = int(os.getenv("SCHEDULER_MAX_BATCH_SIZE", "16"))
+SCHEDULER_MAX_WAIT_MS = float(os.getenv("SCHEDULER_MAX_WAIT_MS", "10"))
+
+
+class InferenceScheduler:
+    """
+    Collects single images from concurrent requests and runs them through the model together.
+    A batch is sent as soon as it has max_batch_size images, or max_wait_ms after its first image arrived.
+    """
+
+    def __init__(self, predict_batch, max_batch_size=SCHEDULER_MAX_BATCH_SIZE, max_wait_ms=SCHEDULER_MAX_WAIT_MS,
+                 name="default"):
+        self._predict_batch = predict_batch  # list of images -> list of predictions, runs on the batch thread
+        self.name = name  # model name, labels the metrics
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+        # stats for /inferenceStats
+        self._batch_sizes = Counter()
+        self._images = 0
+        self._wait_time = 0.0
+        self._predict_time = 0.0
+
+    def submit(self, image):
+        """Queue one BGR image and return a Future that resolves to its prediction."""
+        self._ensure_thread()
+        future = Future()
+        self._queue.put((image, future, time.perf_counter()))
+        return future
+
+    def predict(self, image, timeout=None):
+        """Blocking helper: queue an image and wait for its result."""
+        return self.submit(image).result(timeout=timeout)
+
+    def _ensure_thread(self):
+        # threads don't survive a fork, so a gunicorn worker has to start its own
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive() or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="inference-scheduler", daemon=True)
+                self._thread.start()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]  # block until there is at least one image
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            images = [item[0] for item in batch]
+            futures = [item[1] for item in batch]
+            start_time = time.perf_counter()
+            try:
+                results = list(self._predict_batch(images))
+            except Exception as e:
+                logging.error(f"Batched inference failed for {len(batch)} images: {e}")
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            end_time = time.perf_counter()
+
+            with self._lock:
+                self._batch_sizes[len(batch)] += 1
+                self._images += len(batch)
+                self._wait_time += sum(start_time - item[2] for item in batch)
+                self._predict_time += end_time - start_time
+            for item in batch:
+                INFERENCE_QUEUE_WAIT.labels(self.name).observe(start_time - item[2])
+
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+    def stats(self):
+        with self._lock:
+            batches = sum(self._batch_sizes.values())
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "batches": batches,
+                "images": self._images,
+                "mean_batch_size": round(self._images / batches, 2) if batches else 0,
+                "batch_size_counts": {str(size): count for size, count in sorted(self._batch_sizes.items())},
+                "mean_queue_wait_ms": round(self._wait_time / self._images * 1000.0, 2) if self._images else 0,
+                "mean_batch_predict_ms": round(self._predict_time / batches * 1000.0, 2) if batches else 0,
+            }
+
+
+# one scheduler per model name, created the first time that model is used
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(name, predict_batch):
+    """The scheduler for model name, created with predict_batch the first time."""
+    scheduler = _schedulers.get(name)
+    if scheduler is None:
+        with _schedulers_lock:
+            scheduler = _schedulers.get(name)
+            if scheduler is None:
+                scheduler = InferenceScheduler(predict_batch, name=name)
+                _schedulers[name] = scheduler
+    return scheduler
+
+
+def all_stats():
+    return {name: scheduler.stats() for name, scheduler in list(_schedulers.items())}
@@ -0,0 +1,87 @@
+"""
+Shared inference process: loads the models once and serves every gunicorn worker over a Unix socket.
+Run with: python -m app.inference_server (gunicorn.conf.py starts it when INFERENCE_MODE=remote,
+with a random INFERENCE_AUTHKEY shared with the workers; set one yourself when starting it by hand)
+"""
+import os       # socket path cleanup
+import logging  # tracking connections and errors
+import threading  # one thread per connected web worker thread
+from multiprocessing.connection import Listener  # local socket server
+from .inference_client import INFERENCE_SOCKET, INFERENCE_AUTHKEY
+from .inference import predict_local, predict_tiles_local
+from .model_registry import registry, DEFAULT_MODEL_NAME
+from . import inference_scheduler  # batches images coming from all the workers together
+
+
+def handle_connection(conn):
+    """Answers requests from one web worker thread until it disconnects."""
+    with conn:
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                if message[0] == "predict":
+                    _, model_name, images = message
+                    if model_name not in registry.names():
+                        raise KeyError(f"No model registered under name '{model_name}'")
+                    scheduler = inference_scheduler.get_scheduler(
+                        model_name, lambda batch, name=model_name: predict_local(name, batch))
+                    # every image goes on the shared queue so requests from different workers share a batch
+                    futures = [scheduler.submit(image) for image in images]
+                    payload = [future.result() for future in futures]
+                elif message[0] == "predict_tiles":
+                    _, model_name, tiles = message
+                    if model_name not in registry.names():
+                        raise KeyError(f"No model registered under name '{model_name}'")
+                    payload = predict_tiles_local(model_name, tiles)
+                elif message[0] == "model_info":
+                    _, model_name = message
+                    if model_name not in registry.names():
+                        raise KeyError(f"No model registered under name '{model_name}'")
+                    registry.get(model_name)
+                    payload = {"imgsz": registry.imgsz(model_name), "backend": registry.backend(model_name)}
+                elif message[0] == "stats":
+                    payload = inference_scheduler.all_stats()
+                else:
+                    raise ValueError(f"Unknown request {message[0]!r}")
+                conn.send(("ok", payload))
+            except (EOFError, OSError):
+                return
+            except Exception as e:
+                logging.error(f"Inference request failed: {e}")
+                try:
+                    conn.send(("error", str(e)))
+                except OSError:
+                    return
+
+
+def serve(address=INFERENCE_SOCKET):
+    if not INFERENCE_AUTHKEY:
+        raise RuntimeError("INFERENCE_AUTHKEY must be set, the socket would accept any local process")
+    # load (and warm up) the default model before accepting work
+    registry.get(os.getenv("MODEL_NAME", DEFAULT_MODEL_NAME))
+
+    if os.path.exists(address):
+        os.remove(address)  # left over from a previous run
+    # the socket is created owner-only, there is no moment with the default permissions
+    old_umask = os.umask(0o177)
+    try:
+        listener = Listener(address, family="AF_UNIX", authkey=INFERENCE_AUTHKEY)
+    finally:
+        os.umask(old_umask)
+    with listener:
+        logging.info(f"Inference process {os.getpid()} listening on {address}")
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                logging.warning(f"Rejected inference connection: {e}")
+                continue
+            threading.Thread(target=handle_connection, args=(conn,), daemon=True).start()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    serve()
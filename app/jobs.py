@@ -0,0 +1,163 @@
+import os       # job settings from environment variables
+import time     # heartbeat interval
+import socket   # which host a job runs on
+import logging  # reporting failed jobs
+import datetime  # job timestamps
+import threading  # heartbeat for the jobs this process owns
+from concurrent.futures import ThreadPoolExecutor  # local worker pool, no external broker needed
+from bson import ObjectId  # job ids
+from pymongo import ReturnDocument  # the job as it is after marking it failed
+from pymongo.errors import PyMongoError  # a missed heartbeat is retried on the next beat
+from .db import get_db  # database on the shared client
+
+
+# job status lives in MongoDB so any gunicorn worker can report on any job
+JOBS_COLLECTION = "inferenceJobs"
+# one document per finished image, a big flight would go past the 16 MB document limit in the job itself
+JOB_RESULTS_COLLECTION = "inferenceJobResults"
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))
+# images handled per step, results are published after each step
+JOB_CHUNK_SIZE = int(os.getenv("JOB_CHUNK_SIZE", "16"))
+# finished jobs are removed by a TTL index after this long
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", str(7 * 24 * 3600)))
+# the process owning a queued/running job marks it alive this often; a job whose mark is older than
+# JOB_STALE_SECONDS lost its worker (killed, timed out, restarted) and is reported as failed
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "10"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "60"))
+
+job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="inference-jobs")
+
+_active = set()  # ids of the jobs queued or running in this process
+_active_lock = threading.Lock()
+_heartbeat_thread = None
+
+
+def _jobs():
+    return get_db()[JOBS_COLLECTION]
+
+
+def _results():
+    return get_db()[JOB_RESULTS_COLLECTION]
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def ensure_job_indexes(db):
+    # old jobs and their results clean themselves up
+    db[JOBS_COLLECTION].create_index("created_at", name="created_at_ttl", expireAfterSeconds=JOB_TTL_SECONDS)
+    db[JOB_RESULTS_COLLECTION].create_index("created_at", name="created_at_ttl", expireAfterSeconds=JOB_TTL_SECONDS)
+    # results are read in order, after the ones a client already has
+    db[JOB_RESULTS_COLLECTION].create_index([("job_id", 1), ("index", 1)], name="job_id_index", unique=True)
+
+
+def _heartbeat():
+    while True:
+        with _active_lock:
+            job_ids = list(_active)
+        if job_ids:
+            try:
+                _jobs().update_many({"_id": {"$in": job_ids}}, {"$set": {"heartbeat_at": _now()}})
+            except PyMongoError as e:
+                logging.warning(f"Could not update the heartbeat of inference jobs {job_ids}: {e}")
+        time.sleep(JOB_HEARTBEAT_SECONDS)
+
+
+def _start_heartbeat():
+    """Started by the first job of each worker process (a thread from before a preload fork wouldn't survive)."""
+    global _heartbeat_thread
+    with _active_lock:
+        if _heartbeat_thread is None or not _heartbeat_thread.is_alive():
+            _heartbeat_thread = threading.Thread(target=_heartbeat, name="inference-job-heartbeat", daemon=True)
+            _heartbeat_thread.start()
+
+
+def submit(items, model_name, process_chunk, chunk_size=JOB_CHUNK_SIZE):
+    """
+    Creates a job for items and queues it on the local worker pool. Returns the job id.
+    process_chunk(items) -> list of per-image result dicts, called with up to chunk_size items at a time.
+    """
+    job_id = ObjectId()
+    now = _now()
+    _jobs().insert_one({
+        "_id": job_id,
+        "status": "queued",
+        "model": model_name,
+        "total": len(items),
+        "completed": 0,
+        "error": None,
+        "owner": {"host": socket.gethostname(), "pid": os.getpid()},
+        "heartbeat_at": now,
+        "created_at": now,
+    })
+    with _active_lock:
+        _active.add(job_id)
+    _start_heartbeat()
+    job_executor.submit(_run, job_id, items, process_chunk, chunk_size)
+    return job_id
+
+
+def _run(job_id, items, process_chunk, chunk_size):
+    jobs = _jobs()
+    try:
+        jobs.update_one({"_id": job_id}, {"$set": {"status": "running"}})
+        for start in range(0, len(items), chunk_size):
+            results = process_chunk(items[start:start + chunk_size])
+            created_at = _now()
+            _results().insert_many([
+                {"job_id": job_id, "index": start + offset, "result": result, "created_at": created_at}
+                for offset, result in enumerate(results)
+            ])
+            jobs.update_one({"_id": job_id}, {"$inc": {"completed": len(results)}})
+        jobs.update_one({"_id": job_id}, {"$set": {"status": "done"}})
+    except Exception as e:
+        logging.error(f"Inference job {job_id} failed: {e}")
+        jobs.update_one({"_id": job_id}, {"$set": {"status": "failed", "error": str(e)}})
+    finally:
+        items.clear()  # let go of the uploaded bytes
+        with _active_lock:
+            _active.discard(job_id)
+
+
+def _fail_if_stale(doc):
+    """Marks a queued/running job whose owner stopped sending heartbeats as failed, returns the current doc."""
+    if doc["status"] not in ("queued", "running"):
+        return doc
+    cutoff = _now() - datetime.timedelta(seconds=JOB_STALE_SECONDS)
+    heartbeat_at = doc.get("heartbeat_at") or doc["created_at"]
+    if heartbeat_at.replace(tzinfo=datetime.timezone.utc) >= cutoff:
+        return doc
+    owner = doc.get("owner") or {}
+    error = f"The worker running this job ({owner.get('host')}:{owner.get('pid')}) stopped"
+    # the filter keeps a job that finished or beat again meanwhile from being overwritten
+    updated = _jobs().find_one_and_update(
+        {"_id": doc["_id"], "status": doc["status"], "heartbeat_at": doc.get("heartbeat_at")},
+        {"$set": {"status": "failed", "error": error}},
+        return_document=ReturnDocument.AFTER,
+    )
+    return updated or _jobs().find_one({"_id": doc["_id"]}) or doc
+
+
+def get(job_id, after=0, results=True):
+    """
+    Job status with only the results after the first `after` ones (none when results=False),
+    or None if it doesn't exist.
+    """
+    doc = _jobs().find_one({"_id": job_id})
+    if doc is None:
+        return None
+    doc = _fail_if_stale(doc)
+    found = []
+    if results:
+        found = [row["result"] for row in _results().find(
+            {"job_id": job_id, "index": {"$gte": after}}, {"result": 1}).sort("index", 1)]
+    return {
+        "job_id": str(doc["_id"]),
+        "status": doc["status"],
+        "model": doc["model"],
+        "total": doc["total"],
+        "completed": doc["completed"],
+        "error": doc.get("error"),
+        "results": found,
+    }
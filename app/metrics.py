@@ -0,0 +1,143 @@
+import os       # metrics settings from environment variables
+import time     # timing stages and requests
+import threading  # command start times are kept per connection/request id
+from contextlib import contextmanager  # `with metrics.timed("stage"):` blocks
+from flask import g, request  # per-request start time and the matched route
+from pymongo import monitoring  # hooks into every command the MongoDB driver sends
+
+try:
+    import prometheus_client  # Prometheus text format and multi-process aggregation
+    from prometheus_client import CollectorRegistry, generate_latest, CONTENT_TYPE_LATEST
+    from prometheus_client import multiprocess
+except ImportError:
+    prometheus_client = None
+
+
+# Every gunicorn worker (and the shared inference process) writes its numbers to files in this folder
+# and /metrics adds them all up. gunicorn.conf.py sets it; without it only this process is reported.
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", "")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class _NoOpMetric:
+    """Stands in for every metric when prometheus-client isn't installed."""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+
+def _metric(kind, *args, **kwargs):
+    """prometheus_client.<kind>(...), e.g. _metric("Counter", ...), or a no-op without prometheus-client."""
+    if prometheus_client is None:
+        return _NoOpMetric()
+    return getattr(prometheus_client, kind)(*args, **kwargs)
+
+
+REQUEST_LATENCY = _metric("Histogram", "http_request_duration_seconds", "Request latency (including streaming the body)",
+                          ["route", "method", "status"], buckets=LATENCY_BUCKETS)
+STAGE_LATENCY = _metric("Histogram", "stage_duration_seconds", "Time spent in one hot-path stage",
+                        ["stage"], buckets=LATENCY_BUCKETS)
+MONGO_OPERATIONS = _metric("Counter", "mongo_operations_total", "MongoDB commands sent",
+                           ["command", "collection", "outcome"])
+MONGO_LATENCY = _metric("Histogram", "mongo_operation_duration_seconds", "MongoDB command round trip",
+                        ["command", "collection"], buckets=LATENCY_BUCKETS)
+INFERENCE_BATCH_SIZE = _metric("Histogram", "inference_batch_size", "Images per model forward pass",
+                               ["model"], buckets=BATCH_SIZE_BUCKETS)
+INFERENCE_BATCH_LATENCY = _metric("Histogram", "inference_batch_duration_seconds", "Preprocessing + forward pass per batch",
+                                  ["model"], buckets=LATENCY_BUCKETS)
+INFERENCE_QUEUE_WAIT = _metric("Histogram", "inference_queue_wait_seconds", "Time an image waited in the micro-batching queue",
+                               ["model"], buckets=LATENCY_BUCKETS)
+INFERENCE_CACHE_LOOKUPS = _metric("Counter", "inference_cache_lookups_total", "Stored prediction lookups", ["outcome"])
+MODEL_LOAD_LATENCY = _metric("Histogram", "model_load_duration_seconds", "Model load time (without warmup)",
+                             ["model", "backend"], buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+MODELS_LOADED = _metric("Gauge", "models_loaded", "Processes that currently hold the model",
+                        ["model", "backend"], multiprocess_mode="livesum")
+APP_STARTUP = _metric("Histogram", "startup_duration_seconds", "Time until a process could serve requests",
+                      ["phase"], buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120))
+
+
+@contextmanager
+def timed(stage):
+    """Records how long the with-block took under stage_duration_seconds{stage=...}."""
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(stage).observe(time.perf_counter() - start_time)
+
+
+def timed_iter(stage, iterable):
+    """Like timed, for a generator that is consumed while the response streams."""
+    start_time = time.perf_counter()
+    try:
+        yield from iterable
+    finally:
+        STAGE_LATENCY.labels(stage).observe(time.perf_counter() - start_time)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Counts and times every command pymongo sends (find, insert, getMore on fs.chunks, ...)."""
+
+    def __init__(self):
+        self._collections = {}  # (connection, request id) -> collection name, succeeded events don't carry it
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        with self._lock:
+            self._collections[(event.connection_id, event.request_id)] = \
+                collection if isinstance(collection, str) else ""
+
+    def _finish(self, event, outcome):
+        with self._lock:
+            collection = self._collections.pop((event.connection_id, event.request_id), "")
+        MONGO_OPERATIONS.labels(event.command_name, collection, outcome).inc()
+        MONGO_LATENCY.labels(event.command_name, collection).observe(event.duration_micros / 1e6)
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "error")
+
+
+def init_app(app):
+    """Times every request by the route that matched it, until the body has finished streaming."""
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start_time = time.perf_counter()
+
+    @app.after_request
+    def record_request_latency(response):
+        start_time = g.get("request_start_time")
+        if start_time is not None:
+            # the URL rule, not the path, so /getImage/<file_id> is one series
+            route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            labels = (route, request.method, str(response.status_code))
+            response.call_on_close(
+                lambda: REQUEST_LATENCY.labels(*labels).observe(time.perf_counter() - start_time))
+        return response
+
+
+def render():
+    """(body, content type) in the Prometheus text format, summed over all processes. None when unavailable."""
+    if prometheus_client is None:
+        return None, None
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,113 @@
+"""
+Rewrites older detection documents (nested GeoJSON Features) in the compact schema 2 layout.
+Images the legacy ingest stored inside the document (properties.image_data_binary) are moved to
+GridFS first and referenced by file_id; a document whose image can't be moved is left as it is.
+Safe to stop and re-run: only documents that aren't converted yet are touched.
+
+    python -m app.migrate_detections            # convert everything
+    python -m app.migrate_detections --dry-run  # only count and show one converted document
+"""
+import argparse
+import hashlib  # same sha256 metadata the upload path stores
+import logging  # progress reporting
+import time     # migration speed
+from pymongo import ReplaceOne  # bulk rewrites
+from pymongo.errors import DuplicateKeyError  # the image is already in GridFS
+from gridfs.errors import FileExists
+from .db import get_db, get_collection, get_fs, bump_collection_version, COLLECTION_NAME
+from .detections import SCHEMA_VERSION, from_legacy, inline_image
+
+
+def collection_size():
+    """(documents, average document bytes, data size, storage size on disk) of the detection collection."""
+    stats = get_db().command("collStats", COLLECTION_NAME)
+    return stats.get("count", 0), stats.get("avgObjSize", 0), stats.get("size", 0), stats.get("storageSize", 0)
+
+
+def move_inline_image(doc):
+    """
+    Stores the image bytes kept inside a legacy document in GridFS (once per content, like uploads)
+    and points the document at it instead. Returns the GridFS id, None if there was nothing to move.
+    """
+    image_bytes = inline_image(doc)
+    if image_bytes is None:
+        return None
+    from .exif import extract_metadata  # EXIF is re-read from the image, the document has offsets applied
+    properties = doc.setdefault("properties", {})
+    sha256 = hashlib.sha256(image_bytes).hexdigest()
+    try:
+        exif = extract_metadata(image_bytes)
+    except Exception:
+        exif = None
+    fs_files = get_db()["fs.files"]
+    existing = fs_files.find_one({"metadata.sha256": sha256}, {"_id": 1})
+    if existing is not None:
+        file_id = existing["_id"]  # an earlier, interrupted run (or an upload) already stored it
+    else:
+        try:
+            file_id = get_fs().put(image_bytes, filename=properties.get("filename"),
+                                   metadata={"exif": exif, "sha256": sha256, "migrated_from": doc["_id"]})
+        except (FileExists, DuplicateKeyError):
+            file_id = fs_files.find_one({"metadata.sha256": sha256}, {"_id": 1})["_id"]
+    properties["file_id"] = str(file_id)
+    properties.pop("image_data_binary", None)
+    doc.pop("image_data", None)
+    return file_id
+
+
+def migrate(batch_size=1000, dry_run=False):
+    collection = get_collection()
+    legacy = {"schema": {"$ne": SCHEMA_VERSION}}
+    total = collection.count_documents(legacy)
+    count, avg_size, data_size, storage_size = collection_size()
+    inline = {**legacy, "$or": [{"properties.image_data_binary": {"$exists": True}}, {"image_data": {"$exists": True}}]}
+    logging.info(f"{total} of {count} documents to convert (avg {avg_size} B, data {data_size / 1e6:.1f} MB, "
+                 f"storage {storage_size / 1e6:.1f} MB), {collection.count_documents(inline)} with the image "
+                 f"stored inline (moved to GridFS)")
+    if dry_run:
+        doc = collection.find_one(legacy, {"properties.image_data_binary": 0, "image_data": 0})
+        if doc is not None:
+            logging.info(f"before: {doc}")
+            logging.info(f"after:  {from_legacy(doc)}")
+        return 0
+
+    start_time = time.perf_counter()
+    converted, moved, skipped = 0, 0, []
+    requests = []
+    for doc in collection.find(legacy, batch_size=batch_size):
+        try:
+            if move_inline_image(doc) is not None:
+                moved += 1
+            # the filter makes a concurrent re-run (or a doc converted meanwhile) a no-op
+            requests.append(ReplaceOne({"_id": doc["_id"], "schema": {"$ne": SCHEMA_VERSION}}, from_legacy(doc)))
+        except Exception as e:
+            # left untouched (image included), the next run tries again
+            skipped.append(doc.get("_id"))
+            logging.error(f"Could not convert {doc.get('_id')}, leaving it as it is: {e}")
+        if len(requests) >= batch_size:
+            converted += collection.bulk_write(requests, ordered=False).modified_count
+            requests.clear()
+            logging.info(f"{converted}/{total} converted, {converted / (time.perf_counter() - start_time):.0f} docs/s")
+    if requests:
+        converted += collection.bulk_write(requests, ordered=False).modified_count
+
+    # the map output is the same, but cached /images responses were built from the old documents
+    bump_collection_version()
+
+    count, avg_size, data_size, storage_size = collection_size()
+    if skipped:
+        logging.warning(f"{len(skipped)} documents were left in the old layout: {skipped[:20]}")
+    logging.info(f"Converted {converted} documents ({moved} images moved to GridFS, {len(skipped)} skipped) "
+                 f"in {time.perf_counter() - start_time:.1f}s, "
+                 f"now avg {avg_size} B, data {data_size / 1e6:.1f} MB "
+                 f"(storage {storage_size / 1e6:.1f} MB, shrinks as WiredTiger reuses the freed space or after compact)")
+    return converted
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Convert detection documents to the compact schema.")
+    parser.add_argument("--batch-size", type=int, default=1000, help="documents per bulk write")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would change")
+    args = parser.parse_args()
+    migrate(args.batch_size, args.dry_run)
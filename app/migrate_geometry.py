@@ -0,0 +1,40 @@
+"""
+Removes geometry fields the 2dsphere index can't take: coordinates null (old /saveResults),
+[null, null] (legacy ingest) or geometry null. Those documents had no GPS position, the map still
+gets their (null) lat/lon from the rest of the document. Run it once when the app logs that the
+geometry_2dsphere index was rejected, then restart the app so it creates the index.
+
+    python -m app.migrate_geometry            # remove them
+    python -m app.migrate_geometry --dry-run  # only count them
+"""
+import argparse
+import logging  # progress reporting
+from .db import get_collection, bump_collection_version
+
+
+INVALID_GEOMETRY = {
+    "geometry": {"$exists": True},
+    "$or": [{"geometry.coordinates.0": {"$not": {"$type": "number"}}},
+            {"geometry.coordinates.1": {"$not": {"$type": "number"}}}],
+}
+
+
+def clean_geometry(dry_run=False):
+    collection = get_collection()
+    count = collection.count_documents(INVALID_GEOMETRY)
+    logging.info(f"{count} documents have a geometry without two numeric coordinates")
+    if dry_run or not count:
+        return 0
+    removed = collection.update_many(INVALID_GEOMETRY, {"$unset": {"geometry": ""}}).modified_count
+    # cached /images responses and tiles were built from the old documents
+    bump_collection_version()
+    logging.info(f"Removed {removed} geometry fields without valid coordinates")
+    return removed
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Remove geometry fields without valid coordinates.")
+    parser.add_argument("--dry-run", action="store_true", help="only report how many documents would change")
+    args = parser.parse_args()
+    clean_geometry(args.dry_run)
@@ -0,0 +1,183 @@
+import os       # backend settings and artifact paths
+import json     # saved validation results
+import glob     # sample images for validation
+import logging  # reporting export/validation results
+import time     # timing exports
+import shutil   # moving finished exports into place
+import tempfile  # exports are written to a scratch folder first
+from contextlib import contextmanager  # `with _export_lock(...)` blocks
+import numpy as np  # synthetic validation images
+import cv2      # reading validation sample images
+
+try:
+    import fcntl  # file lock so only one gunicorn worker exports at a time (not on Windows)
+except ImportError:
+    fcntl = None
+
+
+# which runtime serves predictions:
+#   "pytorch"   - the original .pt through torch
+#   "onnx"      - exported ONNX model through ONNX Runtime
+#   "onnx-int8" - ONNX with weights dynamically quantized to INT8
+#   "openvino"  - OpenVINO IR (add MODEL_INT8=1 for INT8 weights)
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "pytorch")
+MODEL_INT8 = os.getenv("MODEL_INT8", "0") == "1"
+
+# exported models must agree with the .pt on at least this share of top-1 predictions, or we fall back
+MODEL_MIN_AGREEMENT = float(os.getenv("MODEL_MIN_AGREEMENT", "0.98"))
+# folder of sample JPEGs for the agreement check, random images are used when it isn't set
+MODEL_VALIDATION_DIR = os.getenv("MODEL_VALIDATION_DIR", "")
+MODEL_VALIDATION_SAMPLES = int(os.getenv("MODEL_VALIDATION_SAMPLES", "32"))
+
+BACKENDS = ("pytorch", "onnx", "onnx-int8", "openvino")
+
+
+def model_imgsz(pt_model, default=224):
+    """Input size the .pt was trained with."""
+    args = getattr(pt_model.model, "args", None) or {}
+    imgsz = args.get("imgsz", default) if isinstance(args, dict) else getattr(args, "imgsz", default)
+    return imgsz[0] if isinstance(imgsz, (list, tuple)) else int(imgsz)
+
+
+def _is_fresh(artifact, source):
+    """True if the exported artifact exists and was made after the .pt last changed."""
+    return os.path.exists(artifact) and os.path.getmtime(artifact) >= os.path.getmtime(source)
+
+
+@contextmanager
+def _export_lock(pt_path):
+    """
+    Held while a model is exported and validated: every gunicorn worker loads the model at the same
+    time, the first one does the work and the others wait and then find the finished files.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.splitext(pt_path)[0] + ".export.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _move_into_place(source, target):
+    """Replaces target with a finished export in one step, so nobody ever sees half of it."""
+    if os.path.isdir(source) and os.path.isdir(target):
+        shutil.rmtree(target)  # a directory can't be replaced atomically, only done under the export lock
+    os.replace(source, target)
+
+
+def _export(pt_path, target, **export_args):
+    """Runs the ultralytics export on a scratch copy of the .pt and moves the result to target."""
+    from ultralytics import YOLO
+    start_time = time.perf_counter()
+    scratch = tempfile.mkdtemp(prefix=".export-", dir=os.path.dirname(os.path.abspath(pt_path)))
+    try:
+        scratch_pt = os.path.join(scratch, os.path.basename(pt_path))
+        shutil.copyfile(pt_path, scratch_pt)
+        exported = YOLO(scratch_pt).export(**export_args)
+        _move_into_place(exported, target)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    logging.info(f"Exported {pt_path} to {target} in {time.perf_counter() - start_time:.1f}s")
+    return target
+
+
+def export_artifact(pt_model, pt_path, backend):
+    """
+    Exports the .pt for backend (once, cached next to the original) and returns the artifact path.
+    Call it under _export_lock; files only appear at their final path once they are complete.
+    """
+    base = os.path.splitext(pt_path)[0]
+    imgsz = model_imgsz(pt_model)
+
+    if backend in ("onnx", "onnx-int8"):
+        onnx_path = base + ".onnx"
+        if not _is_fresh(onnx_path, pt_path):
+            # dynamic batch so one session can run our batches of any size
+            _export(pt_path, onnx_path, format="onnx", imgsz=imgsz, dynamic=True, simplify=False)
+        if backend == "onnx":
+            return onnx_path
+
+        int8_path = base + ".int8.onnx"
+        if not _is_fresh(int8_path, pt_path):
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            scratch_path = f"{int8_path}.{os.getpid()}.tmp"
+            quantize_dynamic(onnx_path, scratch_path, weight_type=QuantType.QInt8)
+            os.replace(scratch_path, int8_path)
+            logging.info(f"Quantized {onnx_path} to {int8_path}")
+        return int8_path
+
+    if backend == "openvino":
+        ir_dir = base + ("_int8_openvino_model" if MODEL_INT8 else "_openvino_model")
+        if not _is_fresh(ir_dir, pt_path):
+            _export(pt_path, ir_dir, format="openvino", imgsz=imgsz, int8=MODEL_INT8, dynamic=True)
+        return ir_dir
+
+    raise ValueError(f"Unknown MODEL_BACKEND '{backend}', expected one of {', '.join(BACKENDS)}")
+
+
+def validation_images(imgsz):
+    """Sample images for the agreement check (BGR arrays)."""
+    if MODEL_VALIDATION_DIR:
+        paths = sorted(glob.glob(os.path.join(MODEL_VALIDATION_DIR, "*.jp*g")))[:MODEL_VALIDATION_SAMPLES]
+        images = [image for image in (cv2.imread(path) for path in paths) if image is not None]
+        if images:
+            return images
+        logging.warning(f"No readable JPEGs in {MODEL_VALIDATION_DIR}, validating on random images")
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 256, (imgsz, imgsz, 3), dtype=np.uint8) for _ in range(MODEL_VALIDATION_SAMPLES)]
+
+
+def top1_agreement(pt_model, exported_model, images):
+    """Share of images where both models pick the same class."""
+    expected = [r.probs.top1 for r in pt_model.predict(images, verbose=False)]
+    actual = [r.probs.top1 for r in exported_model.predict(images, verbose=False)]
+    return sum(1 for a, b in zip(expected, actual) if a == b) / len(expected)
+
+
+def load_model(path, backend=MODEL_BACKEND):
+    """
+    Loads the model at path with the chosen backend. Exported models are only used if they
+    agree with the PyTorch model on the validation set, otherwise the .pt is served.
+    Returns (model, backend actually used, input size).
+    """
+    from ultralytics import YOLO
+    pt_model = YOLO(path)
+    imgsz = model_imgsz(pt_model)
+    if backend == "pytorch":
+        return pt_model, "pytorch", imgsz
+
+    try:
+        with _export_lock(path):
+            artifact = export_artifact(pt_model, path, backend)
+            exported_model = YOLO(artifact, task=pt_model.task)
+
+            # validation results are saved next to the artifact so each worker doesn't redo it
+            report_path = artifact.rstrip("/\\") + ".validation.json"
+            report = None
+            if _is_fresh(report_path, artifact):
+                with open(report_path) as f:
+                    report = json.load(f)
+            if report is None:
+                images = validation_images(imgsz)
+                report = {
+                    "agreement": top1_agreement(pt_model, exported_model, images),
+                    "samples": len(images),
+                    "source": "dir" if MODEL_VALIDATION_DIR else "random",
+                }
+                scratch_path = f"{report_path}.{os.getpid()}.tmp"
+                with open(scratch_path, "w") as f:
+                    json.dump(report, f)
+                os.replace(scratch_path, report_path)
+
+        if report["agreement"] < MODEL_MIN_AGREEMENT:
+            logging.error(f"{backend} model agrees with PyTorch on only {report['agreement']:.1%} of "
+                          f"{report['samples']} samples, serving the PyTorch model instead")
+            return pt_model, "pytorch", imgsz
+        logging.info(f"Serving {artifact} ({backend}), top-1 agreement {report['agreement']:.1%}")
+        return exported_model, backend, imgsz
+    except Exception as e:
+        logging.error(f"Could not use the {backend} backend, serving the PyTorch model instead: {e}")
+        return pt_model, "pytorch", imgsz
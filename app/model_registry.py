@@ -0,0 +1,133 @@
+import os       # reading model settings from environment variables
+import logging  # tracking when models get loaded and warmed up
+import threading  # locking so two requests don't load the same model at once
+import time     # timing how long loading/warmup takes
+from .metrics import MODEL_LOAD_LATENCY, MODELS_LOADED  # load time and loaded copies for /metrics
+
+
+DEFAULT_MODEL_NAME = os.getenv("MODEL_NAME", "singleModel_0.0.1")
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(__file__), "singleModel_0.0.1.pt")
+
+# size of the blank image used for the first (warmup) predict call
+WARMUP_IMAGE_SIZE = int(os.getenv("MODEL_WARMUP_SIZE", "224"))
+
+# torch CPU threads for this process (0 = torch's default, one per core)
+# with several gunicorn workers each running inference, keep workers * threads <= cores
+TORCH_NUM_THREADS = int(os.getenv("TORCH_NUM_THREADS", "0"))
+TORCH_INTEROP_THREADS = int(os.getenv("TORCH_INTEROP_THREADS", "0"))
+_torch_configured = False
+
+
+def configure_torch_threads():
+    """Applies the thread settings once, before the first model runs."""
+    global _torch_configured
+    if _torch_configured:
+        return
+    import torch
+    if TORCH_NUM_THREADS > 0:
+        torch.set_num_threads(TORCH_NUM_THREADS)
+    if TORCH_INTEROP_THREADS > 0:
+        try:
+            torch.set_num_interop_threads(TORCH_INTEROP_THREADS)
+        except RuntimeError as e:
+            # can only be set before torch starts any parallel work
+            logging.warning(f"Could not set torch interop threads: {e}")
+    _torch_configured = True
+    logging.info(f"torch using {torch.get_num_threads()} intra-op / {torch.get_num_interop_threads()} inter-op threads")
+
+
+class ModelRegistry:
+    """Keeps loaded YOLO models in memory, keyed by name, so each worker only loads them once."""
+
+    def __init__(self):
+        self._paths = {}   # name -> path to the .pt file
+        self._models = {}  # name -> loaded (and warmed up) YOLO model
+        self._backends = {}  # name -> runtime actually serving it (pytorch, onnx, ...)
+        self._imgsz = {}  # name -> square input size the model was trained with
+        self._cold = set()  # loaded but not warmed up yet (preloaded in the gunicorn master)
+        self._lock = threading.Lock()
+
+    def register(self, name, path):
+        """Remember where a model lives without loading it yet."""
+        with self._lock:
+            if self._paths.get(name) != path:
+                self._paths[name] = path
+                self._models.pop(name, None)  # path changed, drop the old copy
+
+    def names(self):
+        return list(self._paths)
+
+    def is_loaded(self, name):
+        return name in self._models
+
+    def backend(self, name):
+        """Runtime serving the model (only known once it is loaded)."""
+        return self._backends.get(name)
+
+    def imgsz(self, name):
+        """Input size of the model (only known once it is loaded)."""
+        return self._imgsz.get(name)
+
+    def get(self, name=DEFAULT_MODEL_NAME, warmup=True):
+        """
+        Return the cached model, loading and warming it up on first use.
+        warmup=False only loads the weights (the gunicorn master in preload mode shouldn't run torch before forking).
+        """
+        model = self._models.get(name)
+        if model is not None and (name not in self._cold or not warmup):
+            return model
+
+        with self._lock:
+            # another thread may have loaded it while we were waiting on the lock
+            model = self._models.get(name)
+            if model is None:
+                if name not in self._paths:
+                    raise KeyError(f"No model registered under name '{name}'")
+                model = self._load(name, self._paths[name])
+                self._models[name] = model
+                self._cold.add(name)
+            if warmup and name in self._cold:
+                self._warmup(name, model)
+                self._cold.discard(name)
+        return model
+
+    def warmup_loaded(self):
+        """Warms up every model that was loaded without it (called in each worker after a preload fork)."""
+        for name in list(self._cold):
+            self.get(name)
+
+    def _load(self, name, path):
+        # ultralytics pulls in torch, only import it in processes that actually run a model
+        from .model_export import load_model
+        configure_torch_threads()
+
+        start_time = time.perf_counter()
+        model, backend, imgsz = load_model(path)
+        self._backends[name] = backend
+        self._imgsz[name] = imgsz
+        load_time = time.perf_counter() - start_time
+
+        logging.info(f"Loaded model '{name}' ({backend}) from {path} in {load_time:.2f}s")
+        MODEL_LOAD_LATENCY.labels(name, backend).observe(load_time)
+        MODELS_LOADED.labels(name, backend).set(1)
+        return model
+
+    def _warmup(self, name, model):
+        # the first predict call builds the graph and allocates buffers, do it now instead of on a user's image
+        import numpy as np
+        start_time = time.perf_counter()
+        warmup_size = self._imgsz.get(name) or WARMUP_IMAGE_SIZE
+        warmup_image = np.zeros((warmup_size, warmup_size, 3), dtype=np.uint8)
+        model.predict(warmup_image, verbose=False)
+        logging.info(f"Warmed up model '{name}' in {time.perf_counter() - start_time:.2f}s")
+
+
+# one registry per process (each gunicorn worker gets its own)
+registry = ModelRegistry()
+registry.register(DEFAULT_MODEL_NAME, DEFAULT_MODEL_PATH)
+
+# extra model versions can be added like EXTRA_MODELS="v2=/models/v2.pt,v3=/models/v3.pt"
+for entry in os.getenv("EXTRA_MODELS", "").split(","):
+    if "=" in entry:
+        extra_name, extra_path = entry.split("=", 1)
+        registry.register(extra_name.strip(), extra_path.strip())
@@ -0,0 +1,114 @@
+import os       # preprocessing settings from environment variables
+import threading  # the buffer pool is shared by request, scheduler and job threads
+from contextlib import contextmanager  # buffers are borrowed for one forward pass
+from io import BytesIO  # reading the JPEG header with PIL
+import numpy as np  # model input buffers
+import cv2      # decoding and resizing
+from PIL import Image  # reading image dimensions without decoding the pixels
+
+
+# fallback input size when the model's own isn't known yet (the shipped model was trained at 640)
+PREPROCESS_SIZE = int(os.getenv("PREPROCESS_SIZE", "640"))
+# decode JPEGs at 1/2, 1/4 or 1/8 scale straight from the DCT coefficients when that still covers PREPROCESS_SIZE
+REDUCED_DECODE = os.getenv("REDUCED_DECODE", "1") == "1"
+# input buffers kept for reuse between forward passes (each is batch x 3 x size x size float32)
+PREPROCESS_POOL_SIZE = int(os.getenv("PREPROCESS_POOL_SIZE", "2"))
+
+_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
+def reduced_decode(file_bytes, min_side=PREPROCESS_SIZE):
+    """
+    Decodes JPEG bytes to a BGR array, letting libjpeg downscale by the largest power of two
+    that keeps the short side at or above min_side (a 20 MP frame decodes at 1/4 for a 640 px model).
+    """
+    buffer = np.frombuffer(file_bytes, dtype=np.uint8)
+    # Ignore the EXIF orientation flag so the pixels match what PIL used to give the model.
+    flags = cv2.IMREAD_COLOR
+    if REDUCED_DECODE and min_side:
+        try:
+            width, height = Image.open(BytesIO(file_bytes)).size  # only parses the header
+        except Exception:
+            width = height = 0
+        for factor, reduced_flag in _REDUCED_FLAGS:
+            if min(width, height) // factor >= min_side:
+                flags = reduced_flag
+                break
+    image = cv2.imdecode(buffer, flags | cv2.IMREAD_IGNORE_ORIENTATION)
+    if image is None:
+        raise ValueError("Could not decode image")
+    return image
+
+
+class Preprocessor:
+    """
+    Turns BGR images into the classifier's input batch (N, 3, size, size) float32 RGB in [0, 1],
+    doing the same steps as ultralytics' classify transforms (short side resize, center crop)
+    in one pass per image, into a buffer borrowed from a small pool shared by all threads.
+    """
+
+    def __init__(self, pool_size=PREPROCESS_POOL_SIZE):
+        self.pool_size = pool_size
+        self._free = []  # buffers not in use right now, at most pool_size of them
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _buffer(self, count, size):
+        """Lends a buffer with room for count images of size, sized to count when a new one is needed."""
+        with self._lock:
+            fitting = [buffer for buffer in self._free if buffer.shape[0] >= count and buffer.shape[2] == size]
+            buffer = min(fitting, key=len) if fitting else None
+            if buffer is not None:
+                self._free.remove(buffer)
+        if buffer is None:
+            buffer = np.empty((count, 3, size, size), dtype=np.float32)
+        try:
+            yield buffer
+        finally:
+            with self._lock:
+                self._free.append(buffer)
+                if len(self._free) > self.pool_size:
+                    # keep the biggest ones, they fit the most requests
+                    self._free.sort(key=len, reverse=True)
+                    del self._free[self.pool_size:]
+
+    @contextmanager
+    def to_batch(self, images, size):
+        """Yields the batch, the buffer goes back to the pool when the with-block ends."""
+        with self._buffer(len(images), size) as buffer:
+            crop = np.empty((size, size, 3), dtype=np.uint8)
+            for i, image in enumerate(images):
+                height, width = image.shape[:2]
+                scale = size / min(height, width)
+                new_width = max(size, round(width * scale))
+                new_height = max(size, round(height * scale))
+                interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+                resized = cv2.resize(image, (new_width, new_height), interpolation=interpolation)
+                top = (new_height - size) // 2
+                left = (new_width - size) // 2
+                cv2.cvtColor(resized[top:top + size, left:left + size], cv2.COLOR_BGR2RGB, dst=crop)
+                # HWC uint8 -> CHW float in [0, 1], written straight into the batch buffer
+                np.multiply(crop.transpose(2, 0, 1), 1.0 / 255.0, out=buffer[i], casting="unsafe")
+            yield buffer[:len(images)]
+
+    @contextmanager
+    def tiles_to_batch(self, tiles):
+        """
+        Batch for a (rows, cols, 3, size, size) BGR tile view (app/tiling.py): tiles are already
+        TILED_TILE_SIZE (a multiple of 32, which the classifier takes as it is), so it is one
+        vectorized BGR->RGB / scale pass with no per-tile resize or copy.
+        Same buffer rules as to_batch.
+        """
+        rows, cols, _, size, _ = tiles.shape
+        count = rows * cols
+        with self._buffer(count, size) as buffer:
+            out = buffer[:count].reshape(rows, cols, 3, size, size)  # view, the buffer is contiguous
+            np.multiply(tiles[:, :, ::-1], 1.0 / 255.0, out=out, casting="unsafe")
+            yield buffer[:count]
+
+
+preprocessor = Preprocessor()
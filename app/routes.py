@@ -1,34 +1,39 @@
 import os       # I use this for working with the file system and environment variables
 import logging  # I use this for debugging and tracking what's happening in the code
 import base64   # I use this for encoding/decoding data to and from Base64
-from flask import Blueprint, render_template, jsonify, request, redirect, url_for, send_file, abort, Flask, Response  # I use these Flask utilities for creating views, rendering templates, sending files, etc.
+from flask import Blueprint, render_template, jsonify, request, redirect, url_for, abort, Flask, Response, current_app  # I use these Flask utilities for creating views, rendering templates, sending files, etc.
 from werkzeug.utils import secure_filename  # I use this to safely handle filenames when uploading
-from pymongo import MongoClient  # I use this to connect to MongoDB databases
 import pymongo  # I use this for additional MongoDB functionality when needed
 from bson import ObjectId, Binary  # I use these for handling MongoDB object IDs and binary data
-import exifread  # I use this to read EXIF data from images
-from io import BytesIO  # creating in-memory streams for file-like operations
-from ultralytics import YOLO  # YOLO inference
+from bson.errors import InvalidId  # raised for file ids that aren't valid ObjectIds
+from .exif import EXIF_HEADER_BYTES, extract_metadata  # GPS/yaw/altitude from the EXIF header
 import time  # time
-import cv2  # image manipulation with OpenCV
-import numpy as np  # numerical operations (like array handling)
-from PIL import Image  #  working with images in Python
-import gridfs  # storing and retrieving the images in MongoDB
+import hashlib  # hashing query strings into ETags
+from gridfs.errors import NoFile, FileExists  # raised when a GridFS file doesn't exist / is a duplicate
+from pymongo.errors import DuplicateKeyError, PyMongoError  # the same image uploaded twice at once, failed stats updates
+from concurrent.futures import ThreadPoolExecutor, Future  # decoding a batch of uploaded images in parallel
+from . import inference_scheduler  # batches single images from concurrent requests together
+from . import inference  # runs predictions in this worker or in the shared inference process
+# OpenCV, NumPy, exifread and torch are imported inside the upload/inference functions that use them,
+# so the map, tile and image endpoints (and worker startup) don't pay for them
+from .inference_client import client as inference_client  # socket to the shared inference process
 
 
 bp = Blueprint("main", __name__)
 
-# Use the Docker service name when running inside Docker
-MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017/")
-
-DATABASE_NAME = "seniorDesignTesting"
-COLLECTION_NAME = "sendAndRecievePlantInfoTest"
-
-
-#file storage system for mongo
-client = MongoClient(MONGO_URI)  # Connect to MongoDB
-db = client[DATABASE_NAME]  # Get database instance
-fs = gridfs.GridFS(db)  #file system in the database for the images
+# one pooled MongoDB client per worker process, see app/db.py for connection settings
+from .db import get_db, get_collection, get_fs, ping, ensure_indexes
+from .db import get_collection_version, reserve_cursor_range, release_cursor_range, cursor_state
+from . import inference_cache  # stored predictions keyed by image hash + model
+from . import jobs  # background inference jobs
+from .response_cache import ResponseCache  # keeps serialized /images responses per collection version
+from . import spatial  # bbox filters and server-side clustering for the map
+from . import tiles  # vector tile encoding and the on-disk tile cache
+from . import derivatives  # thumbnail and medium preview versions of the stored images
+from . import metrics  # per-stage timings and the /metrics endpoint
+from .features import FEATURE_PROJECTION, CURSOR_BATCH_SIZE, feature_from_doc, feature_json, iter_feature_collection, gzip_chunks, dumps
+from . import detections  # compact on-disk layout of the detection documents
+from . import stats  # per-area, per-class counts kept up to date by /saveResults
 
 # Local/OneDrive folder for uploads:
 # UPLOAD_FOLDER = r"C:\Users\frost\OneDrive - The Pennsylvania State University\2024_drone_images\purple_loosestrife\07-17-2024"
@@ -36,6 +41,26 @@ fs = gridfs.GridFS(db)  #file system in the database for the images
 
 ALLOWED_EXTENSIONS = {"jpg", "jpeg"}
 
+# gzip the streamed GeoJSON when the browser supports it
+USE_GZIP = os.getenv("USE_GZIP", "1") == "1"
+
+# serialized /images responses, keyed by collection version + query, so unchanged data isn't rescanned
+images_cache = ResponseCache()
+
+# how many images go through the model in one predict call, and how many threads decode uploads
+INFERENCE_BATCH_SIZE = int(os.getenv("INFERENCE_BATCH_SIZE", "16"))
+MAX_INFERENCE_BATCH_SIZE = 64
+DECODE_WORKERS = int(os.getenv("DECODE_WORKERS", "4"))
+UPLOAD_READ_CHUNK_SIZE = 1024 * 1024
+# how often the job event stream checks for new results
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "0.5"))
+# an event stream ends after this long and the browser reconnects with Last-Event-ID, so a stream
+# never holds a request thread for good
+JOB_EVENTS_MAX_SECONDS = float(os.getenv("JOB_EVENTS_MAX_SECONDS", "300"))
+
+# GridFS writes of uploads happen on these threads while the image is decoded and run through the model
+upload_executor = ThreadPoolExecutor(max_workers=int(os.getenv("UPLOAD_WORKERS", "4")), thread_name_prefix="gridfs-upload")
+
 # Offsets for drone error Skydio X2E (values made from trial and error):
 LATITUDE_OFFSET = 0.00004
 LONGITUDE_OFFSET = 0.00
@@ -43,14 +68,14 @@ AGL_OFFSET_FEET = -10  # Adjust to make AGL values ~20 feet
 
 logging.basicConfig(level=logging.INFO)
 
-#testing connection with mongoDB
-def connect_to_mongodb():
-    """Connects to MongoDB and returns a client."""
-    client = MongoClient(MONGO_URI)
-    # Quick test to ensure we can ping the server
-    client.admin.command("ping")
-    print("Connected successfully to MongoDB")
-    return client
+#testing connection with mongoDB (kept off the request hot path)
+@bp.route("/health")
+def health():
+    try:
+        ping()
+    except Exception as e:
+        return jsonify({"status": "error", "mongodb": str(e)}), 503
+    return jsonify({"status": "ok", "startup_seconds": current_app.config.get("STARTUP_SECONDS")})
 
 #MAPBOX
 
@@ -63,94 +88,327 @@ def index():
 #mapbox.html calls this to get the images from the database
 @bp.route('/images')
 def get_images():
-    """Fetches image data from MongoDB and returns it as a GeoJSON FeatureCollection."""
-    client = connect_to_mongodb()
-    db = client[DATABASE_NAME]
-    collection = db[COLLECTION_NAME]
-
-    docs = collection.find({})
-#start the geojson data
-    geojson_data = {
-        "type": "FeatureCollection",
-        "features": []
-    }
-
-    for doc in docs:
-        # Convert ObjectId to string so that mapbox had a marker id for the point for clustering
-        doc_id = str(doc["_id"])
-
-        # Access the 'properties' dictionary correctly
-        properties = doc.get("properties", {})
-
-        # Create a valid GeoJSON feature
-        feature = {
-            "type": "Feature",
-            "properties": {
-                "_id": doc_id,
-                "filename": properties.get("filename"),
-                "lat": properties.get("lat"),
-                "lon": properties.get("lon"),
-                "yaw": properties.get("yaw"),
-                "msl_alt": properties.get("msl_alt"),
-                "agl": properties.get("agl", "undefined"),
-                "agl_feet": properties.get("agl_feet", "undefined"),
-                "predicted_class": properties.get("predicted_class"),
-                "probabilities": properties.get("probabilities"),
-                "file_id": properties.get("file_id") #the id where the image is being stored
-            },
-            "geometry": {
-                "type": "Point",
-                "coordinates": [properties.get("lon"), properties.get("lat")]
-            }
-        }
-
-        geojson_data["features"].append(feature)
+    """
+    Streams image data from MongoDB as a GeoJSON FeatureCollection.
+    Optional ?bbox=minLon,minLat,maxLon,maxLat only returns points in view, and with ?zoom=
+    below CLUSTER_MAX_ZOOM the points are grouped into grid clusters with per-class counts.
+    Every response has a next_cursor; ?since=<cursor> returns only the points saved after it
+    (never clustered), so the map can poll for new detections without reloading everything.
+    """
+    collection = get_collection()
+
+    # same data version + same query = same response, answer 304 or from the cache without touching the collection
+    version = get_collection_version()
+    query = "&".join(f"{k}={v}" for k, v in sorted(request.args.items(multi=True)))
+    etag = f"{version}-{hashlib.md5(query.encode('utf-8')).hexdigest()[:12]}"
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    use_gzip = accepts_gzip()
+    cache_key = (version, query, use_gzip)
+    body = images_cache.get(cache_key)
+    if body is not None:
+        return geojson_response(body, etag, use_gzip)
 
-    return jsonify(geojson_data)
+    try:
+        bbox = spatial.parse_bbox(request.args["bbox"]) if "bbox" in request.args else None
+        zoom = spatial.parse_zoom(request.args["zoom"]) if "zoom" in request.args else None
+        since = int(request.args["since"]) if "since" in request.args else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    match = {}
+    if bbox is not None:
+        ensure_indexes()
+        match = spatial.bbox_filter(bbox)
+
+    # read before scanning: anything saved during the scan is sent again next time rather than skipped
+    horizon, last = cursor_state()
+    clustered = since is None and zoom is not None and zoom < spatial.CLUSTER_MAX_ZOOM
+    extra = {"next_cursor": horizon, "delta": since is not None, "clustered": clustered}
+
+    if since is not None and since > last:
+        # the collection was reset since the client last synced, it has to reload everything
+        return jsonify({"type": "FeatureCollection", "features": [], "next_cursor": horizon, "reset": True})
+
+    if since is not None:
+        ensure_indexes()
+        match["seq"] = {"$gt": since, "$lte": horizon}
+        docs = collection.find(match, FEATURE_PROJECTION, batch_size=CURSOR_BATCH_SIZE)
+        features = (feature_json(doc) for doc in docs)
+    elif clustered:
+        clusters = collection.aggregate(spatial.cluster_pipeline(match, zoom), allowDiskUse=True)
+        features = (spatial.cluster_feature(doc, zoom) for doc in clusters)
+    else:
+        # only pull the fields we send, and stream documents in batches instead of loading them all
+        docs = collection.find(match, FEATURE_PROJECTION, batch_size=CURSOR_BATCH_SIZE)
+        features = (feature_json(doc) for doc in docs)
+
+    # the scan runs while the response streams, so it is timed as the features are consumed
+    return stream_geojson(metrics.timed_iter("images_scan", features), extra=extra, etag=etag, cache_key=cache_key)
+
+def accepts_gzip():
+    return USE_GZIP and "gzip" in request.headers.get("Accept-Encoding", "")
+
+def geojson_response(body, etag=None, gzipped=False):
+    """Response for a GeoJSON body (bytes or a generator of byte chunks)."""
+    headers = {"Vary": "Accept-Encoding"}
+    if gzipped:
+        headers["Content-Encoding"] = "gzip"
+    response = Response(body, mimetype="application/json", headers=headers)
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+        # the browser keeps the body but has to check the ETag each time
+        response.headers["Cache-Control"] = "no-cache"
+    return response
+
+def stream_geojson(features, extra=None, etag=None, cache_key=None):
+    """Sends features as a chunked FeatureCollection response, gzipped if the browser accepts it."""
+    chunks = iter_feature_collection(features, extra)
+    use_gzip = accepts_gzip()
+    if use_gzip:
+        chunks = gzip_chunks(chunks)
+    if cache_key is not None:
+        chunks = images_cache.tee(cache_key, chunks)
+    return geojson_response(chunks, etag, use_gzip)
+
+#vector tiles of the detections, mapbox only fetches the tiles it needs for the current view
+@bp.route("/tiles/<int:z>/<int:x>/<int:y>.mvt")
+def get_tile(z, x, y):
+    if not tiles.valid_tile(z, x, y):
+        return jsonify({"error": "Tile out of range"}), 404
+    if tiles.mapbox_vector_tile is None:
+        return jsonify({"error": "Vector tiles need the mapbox-vector-tile package"}), 501
+
+    # read before the points: a tile that races a save is kept under the older version, never served again
+    version = get_collection_version()
+    data = tiles.get_cached(version, z, x, y)
+    cache_status = "HIT"
+    if data is None:
+        cache_status = "MISS"
+        ensure_indexes()
+        collection = get_collection()
+        # same rules as /images: clusters when zoomed out, raw points when zoomed in
+        if z < spatial.CLUSTER_MAX_ZOOM:
+            # only this tile's own points, in cells that end at the tile edges, so neighbouring tiles
+            # never draw the same points as a second cluster
+            bbox = tiles.tile_bbox(z, x, y)
+            cell, origin, per_side = spatial.tile_cluster_grid(bbox)
+            pipeline = spatial.cluster_pipeline(spatial.bbox_filter(bbox), z, cell, origin, per_side)
+            docs = collection.aggregate(pipeline, allowDiskUse=True)
+            features = (spatial.cluster_feature(doc, z, id_prefix=f"{z}/{x}/{y}") for doc in docs)
+        else:
+            # points in the buffer too, so icons near the edge aren't cut off
+            match = spatial.bbox_filter(tiles.tile_bbox(z, x, y, buffer=tiles.TILE_BUFFER))
+            docs = collection.find(match, FEATURE_PROJECTION, batch_size=CURSOR_BATCH_SIZE)
+            features = (feature_from_doc(doc) for doc in docs)
+        data = tiles.encode_tile(features, z, x, y)
+        tiles.put_cached(version, z, x, y, data)
+
+    response = Response(data, mimetype="application/vnd.mapbox-vector-tile")
+    response.headers["X-Tile-Cache"] = cache_status
+    # tiles change when new results are saved, so browsers only keep them briefly
+    response.headers["Cache-Control"] = "public, max-age=60"
+    return response
 
 #when user clicks unclustered points on the map, they will be given the image.
 # have to do this because images cannot go into geoJSON data and it is long if it in binary
 @bp.route("/getImage/<file_id>", methods=["GET"])
 def get_image(file_id):
-    """Retrieve and serve an image stored in MongoDB GridFS."""
+    """
+    Stream an image stored in MongoDB GridFS, with Range and ETag support.
+    ?size=thumb or ?size=medium sends a smaller preview instead of the original.
+    """
+    size = request.args.get("size")
+    if size is not None and size not in derivatives.DERIVATIVE_SIZES:
+        return jsonify({"error": f"size must be one of {', '.join(derivatives.DERIVATIVE_SIZES)}"}), 400
+
     try:
         # Convert file_id from string to ObjectId
         file_object_id = ObjectId(file_id) # ObjectId is a unique identifier for documents in a MongoDB database
+    except InvalidId:
+        return jsonify({"error": f"Invalid image id: {file_id}"}), 400
 
-        # Retrieve the image from GridFS
-        retrieved_file = fs.get(file_object_id)
-
-        return send_file(BytesIO(retrieved_file.read()), mimetype="image/jpeg") # MIME type image/jpeg is used to denote the presence of images compressed and stored in the JPEG format
-
-    except Exception as e:
-        return jsonify({"error": f"Image not found: {str(e)}"}), 404
-
+    try:
+        # Opening a GridOut only reads the file document, the chunks are read as we stream
+        if size is not None:
+            with metrics.timed("derivative"):
+                retrieved_file = derivatives.get_or_create_derivative(file_object_id, size)
+        else:
+            with metrics.timed("gridfs_open"):
+                retrieved_file = get_fs().get(file_object_id)
+    except NoFile:
+        return jsonify({"error": f"Image not found: {file_id}"}), 404
+
+    return stream_grid_file(retrieved_file)
+
+def stream_grid_file(grid_file):
+    """Sends a GridFS file chunk by chunk, answering conditional and Range requests."""
+    # GridFS files never change once written, so the md5 (or the id on newer pymongo) is a strong ETag
+    etag = getattr(grid_file, "md5", None) or str(grid_file._id)
+    length = grid_file.length
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "public, max-age=31536000, immutable",
+    }
 
+    if etag in request.if_none_match:
+        response = Response(status=304, headers=headers)
+        response.set_etag(etag)
+        return response
+
+    status = 200
+    start, stop = 0, length
+    # If-Range: only honour the Range if it names this file by its strong ETag (a date or weak tag gets
+    # the whole file). A Range we can't parse or with several ranges is ignored, as RFC 9110 allows.
+    if_range = request.headers.get("If-Range")
+    range_allowed = if_range is None or (not if_range.startswith("W/") and request.if_range.etag == etag)
+    if (range_allowed and request.range is not None and request.range.units == "bytes"
+            and len(request.range.ranges) == 1):
+        byte_range = request.range.range_for_length(length)
+        if byte_range is None:
+            response = Response(status=416, headers=headers)
+            response.headers["Content-Range"] = f"bytes */{length}"
+            return response
+        start, stop = byte_range
+        status = 206
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{length}"
+
+    headers["Content-Length"] = str(stop - start)
+
+    def generate():
+        grid_file.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = grid_file.read(min(grid_file.chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+    # MIME type image/jpeg is used to denote the presence of images compressed and stored in the JPEG format
+    mimetype = getattr(grid_file, "content_type", None) or "image/jpeg"
+    response = Response(metrics.timed_iter("gridfs_stream", generate()), status=status, mimetype=mimetype,
+                        headers=headers, direct_passthrough=True)
+    response.set_etag(etag)
+    return response
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def convert_to_degrees(value, ref_tag):
+def read_upload(file):
+    """Reads an uploaded file in chunks, hashing it as it goes. Returns (bytes, sha256 hex digest)."""
+    digest = hashlib.sha256()
+    data = bytearray()
+    while True:
+        chunk = file.stream.read(UPLOAD_READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+        data += chunk
+    return bytes(data), digest.hexdigest()
+
+def put_upload(file_bytes, file_id, filename, sha256):
     """
-    Converts the GPS coordinates stored in the EXIF to degrees in float format.
-    :param value: EXIF GPS coordinate value.
-    :param ref_tag: EXIF GPS reference tag (e.g., 'N', 'S', 'E', 'W').
-    :return: GPS coordinate in degrees (float) or None if conversion fails.
+    Writes an upload to GridFS with its EXIF GPS/yaw/altitude parsed once and kept in the file metadata.
+    Returns the id the image ended up under (an identical image saved at the same time wins).
     """
     try:
-        d = value.values[0].num / value.values[0].den
-        m = value.values[1].num / value.values[1].den
-        s = value.values[2].num / value.values[2].den
-        result = d + (m / 60.0) + (s / 3600.0)
-        if ref_tag and ref_tag.values[0] in ['S', 'W']:
-            result = -result
-        return result
+        with metrics.timed("exif"):
+            exif = extract_metadata(file_bytes)
     except Exception as e:
-        logging.error(f"Error converting GPS value: {e}")
-        return None
-
+        logging.error(f"Error reading EXIF from {filename}: {e}")
+        exif = None
+    try:
+        with metrics.timed("gridfs_put"):
+            return get_fs().put(file_bytes, _id=file_id, filename=filename, metadata={"exif": exif, "sha256": sha256})
+    except (FileExists, DuplicateKeyError):
+        # the unique sha256 index rejected us, remove our chunks and point at the existing copy
+        get_db()["fs.chunks"].delete_many({"files_id": file_id})
+        existing = find_file_by_hash(sha256)
+        if existing is None:
+            raise
+        return existing
+
+def find_file_by_hash(sha256):
+    doc = get_db()["fs.files"].find_one({"metadata.sha256": sha256}, {"_id": 1})
+    return doc["_id"] if doc else None
+
+def read_exif_from_gridfs(file_id):
+    """Fallback for files uploaded before EXIF was stored: reads only the header chunk and saves the result."""
+    with metrics.timed("gridfs_read"):
+        header_bytes = get_fs().get(file_id).read(EXIF_HEADER_BYTES)
+    with metrics.timed("exif"):
+        exif = extract_metadata(header_bytes)
+    get_db()["fs.files"].update_one({"_id": file_id}, {"$set": {"metadata.exif": exif}})
+    return exif
+
+def decode_image(file_bytes, min_side=None):
+    """
+    Turns uploaded JPEG bytes into a BGR NumPy array for the model.
+    OpenCV decodes straight to BGR from the request buffer, and when min_side is given it decodes
+    at a reduced scale (1/2, 1/4, 1/8) that still covers the model's input size.
+    """
+    from .preprocess import reduced_decode  # JPEG decode at reduced scale
+    with metrics.timed("decode"):
+        return reduced_decode(file_bytes, min_side)
 
-model_path = os.path.join(os.getcwd(), "app", "singleModel_0.0.1.pt") #get the trained model
+def store_upload(file_bytes, filename, sha256):
+    """
+    Starts writing an upload to GridFS in the background and returns a future for its file id.
+    Images we already have (same SHA-256) aren't stored again, the future resolves to the existing id.
+    """
+    existing = find_file_by_hash(sha256)
+    if existing is not None:
+        future = Future()
+        future.set_result(existing)
+        return future
+
+    file_id = ObjectId()
+    future = upload_executor.submit(put_upload, file_bytes, file_id, filename, sha256)
+    # thumbnails/previews are made in the background so the results page and map popups load fast
+    derivatives.schedule_after_upload(future, file_bytes, filename)
+    return future
+
+def tiled_prediction(model_name, image, file_bytes):
+    """Sliding-window prediction for one decoded upload, tile centers placed using its EXIF position."""
+    from . import tiling  # sliding-window classification with per-tile heatmaps
+    try:
+        with metrics.timed("exif"):
+            metadata = extract_metadata(file_bytes)
+    except Exception as e:
+        # still classified, the tiles just can't be placed on the map
+        logging.error(f"Error reading EXIF for tiled prediction: {e}")
+        metadata = {"lat": None, "lon": None, "yaw": None, "msl_alt": None}
+    if metadata["lat"] is not None and metadata["lon"] is not None:
+        metadata["lat"] -= LATITUDE_OFFSET
+        metadata["lon"] -= LONGITUDE_OFFSET
+    # all tiles of the image go through the model as one batch
+    with metrics.timed("inference_tiled"):
+        return tiling.classify_tiled(lambda tile_view: inference.predict_tiles(model_name, tile_view),
+                                     image, metadata)
+
+def cache_version(model_name, tiled=False):
+    """Stored predictions are kept apart per model/backend and for tiled mode (per tile layout)."""
+    version = inference.model_version(model_name)
+    if tiled:
+        from . import tiling
+        return f"{version}/tiled-{tiling.TILED_TILE_SIZE}-{tiling.TILED_DECODE_MIN_SIDE}"
+    return version
+
+def build_result(prediction, filename, file_id, model_name, cached=False):
+    """The dict we send back to the page for one image."""
+    return {
+        "filename": filename,
+        **prediction,
+        "model": model_name,
+        "cached": cached,
+        "file_id": str(file_id)  # Store MongoDB file ID
+    }
 
 #running model on images
 @bp.route("/runInferenceTest", methods=["GET", "POST"])
@@ -167,50 +425,313 @@ def run_inference():
 
     if file and allowed_file(file.filename):
         filename = secure_filename(file.filename)
+        file_bytes, sha256 = read_upload(file)
 
-        # Save file to MongoDB GridFS
-        file_id = fs.put(file, filename=filename)
-        print(f"Saved to MongoDB with ID: {file_id}")
+        # the form can pick a different registered model version, otherwise use the app default
+        model_name = request.form.get("model", current_app.config["MODEL_NAME"])
+        try:
+            inference.check_model(model_name)  # already loaded and warmed up
+        except KeyError as e:
+            return jsonify({"error": str(e)}), 400
+        # tiled=1: classify overlapping tiles and return a heatmap instead of one whole-frame prediction
+        tiled = request.form.get("tiled") == "1"
 
-        # Retrieve the image from MongoDB
-        retrieved_file = fs.get(file_id)
-        image_data = np.array(Image.open(BytesIO(retrieved_file.read())))  # Convert to NumPy array
-        image_data = cv2.cvtColor(image_data, cv2.COLOR_RGB2BGR)  # Convert RGB to BGR
+        # Save file to MongoDB GridFS in the background (unless we already have it)
+        store_future = store_upload(file_bytes, filename, sha256)
 
         start_time = time.perf_counter() # start timer
-        
-        model = YOLO(model_path)
-        # Run YOLO inference
-        results = model.predict(image_data, stream=True)
-        results_list = []
-
-        for result in results:
-            top_index = result.probs.top1  # Get top prediction index
-            top_class = result.names[top_index]  # Get class name
-            probabilities = result.probs.data.tolist()  # Get probabilities
-
-            results_list.append({
-                "filename": filename,
-                "predicted_class": top_class,
-                "probabilities": probabilities,
-                "top_index": top_index,
-                "file_id": str(file_id)  # Store MongoDB file ID
-            })
+
+        # same image already run through this model: reuse the stored prediction
+        prediction = inference_cache.lookup_many([sha256], cache_version(model_name, tiled)).get(sha256)
+        cached = prediction is not None
+        if not cached:
+            try:
+                if tiled:
+                    from . import tiling
+                    image_data = decode_image(file_bytes, tiling.TILED_DECODE_MIN_SIDE)
+                    prediction = tiled_prediction(model_name, image_data, file_bytes)
+                else:
+                    image_data = decode_image(file_bytes, inference.input_size(model_name))
+                    # Run YOLO inference (batched together with other requests' images when the scheduler is on)
+                    with metrics.timed("inference"):
+                        prediction = inference.predict_image(model_name, image_data)
+            except ValueError as e:
+                file_id = store_future.result()
+                return jsonify({"error": f"{filename}: {e}", "file_id": str(file_id)}), 400
+            inference_cache.store_many({sha256: prediction}, cache_version(model_name, tiled))
 
         end_time = time.perf_counter()
         elapsed_time = round(end_time - start_time, 4)
 
+        # make sure the image is in GridFS before the page asks for it with /getImage
+        file_id = store_future.result()
+        print(f"Saved to MongoDB with ID: {file_id}")
+
         return jsonify({
-            "results": results_list,
+            "results": [build_result(prediction, filename, file_id, model_name, cached)],
             "elapsed_time": elapsed_time
         })
 
+def predict_uploads(model_name, hashes, file_bytes_list, batch_size, timings=None, tiled=False):
+    """
+    Predictions for a list of uploads as ({sha256: prediction}, set of hashes that came from the cache).
+    Images this model has already seen skip decoding and inference, and identical files are only run once.
+    With tiled=True every image is classified tile by tile (its tiles are the batch).
+    Raises ValueError if one of the images can't be decoded (batches before it are already cached).
+    """
+    timings = timings if timings is not None else {}
+    predictions = inference_cache.lookup_many(hashes, cache_version(model_name, tiled))
+    cached_hashes = set(predictions)
+    to_run = {}  # sha256 -> index of the first file with that content
+    for index, sha256 in enumerate(hashes):
+        if sha256 not in predictions and sha256 not in to_run:
+            to_run[sha256] = index
+    run_indexes = list(to_run.values())
+
+    min_side = inference.input_size(model_name)
+    if tiled:
+        from . import tiling
+        min_side = tiling.TILED_DECODE_MIN_SIDE
+
+    # Decode and run batch_size images at a time, so only one batch of decoded frames is in memory
+    decode_seconds, inference_seconds = 0.0, 0.0
+    with ThreadPoolExecutor(max_workers=DECODE_WORKERS) as pool:
+        for i in range(0, len(run_indexes), batch_size):
+            batch_indexes = run_indexes[i:i + batch_size]
+            # decoded in parallel (OpenCV releases the GIL while decoding)
+            start_time = time.perf_counter()
+            images = list(pool.map(lambda index: decode_image(file_bytes_list[index], min_side), batch_indexes))
+            decode_seconds += time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            batch_predictions = {}
+            with metrics.timed("inference_batch"):
+                if tiled:
+                    for index, image in zip(batch_indexes, images):
+                        batch_predictions[hashes[index]] = tiled_prediction(model_name, image, file_bytes_list[index])
+                else:
+                    for index, prediction in zip(batch_indexes, inference.predict_images(model_name, images)):
+                        batch_predictions[hashes[index]] = prediction
+            del images
+            inference_cache.store_many(batch_predictions, cache_version(model_name, tiled))
+            predictions.update(batch_predictions)
+            inference_seconds += time.perf_counter() - start_time
+    timings["decode"] = round(decode_seconds, 4)
+    timings["inference"] = round(inference_seconds, 4)
+
+    return predictions, cached_hashes
+
+#running model on a whole flight of images in one request
+@bp.route("/runInferenceBatch", methods=["POST"])
+def run_inference_batch():
+    files = [f for f in request.files.getlist("file") if f and f.filename != "" and allowed_file(f.filename)]
+    if not files:
+        return jsonify({"error": "No valid .jpg/.jpeg files in request"}), 400
+
+    try:
+        batch_size = int(request.form.get("batch_size", INFERENCE_BATCH_SIZE))
+    except ValueError:
+        return jsonify({"error": "batch_size must be an integer"}), 400
+    batch_size = max(1, min(batch_size, MAX_INFERENCE_BATCH_SIZE))
+
+    model_name = request.form.get("model", current_app.config["MODEL_NAME"])
+    try:
+        inference.check_model(model_name)
+    except KeyError as e:
+        return jsonify({"error": str(e)}), 400
+
+    tiled = request.form.get("tiled") == "1"
+
+    timings = {}
+    total_start = time.perf_counter()
+
+    # Start saving every file to MongoDB GridFS in the background, we keep the bytes for decoding
+    filenames, hashes, store_futures, file_bytes_list = [], [], [], []
+    for file in files:
+        filename = secure_filename(file.filename)
+        file_bytes, sha256 = read_upload(file)
+        filenames.append(filename)
+        hashes.append(sha256)
+        store_futures.append(store_upload(file_bytes, filename, sha256))
+        file_bytes_list.append(file_bytes)
+
+    try:
+        predictions, cached_hashes = predict_uploads(model_name, hashes, file_bytes_list, batch_size, timings, tiled)
+    except ValueError as e:
+        for store_future in store_futures:
+            store_future.result()
+        return jsonify({"error": str(e)}), 400
+    del file_bytes_list
+
+    # whatever is left of the GridFS writes after decode + inference
+    start_time = time.perf_counter()
+    file_ids = [store_future.result() for store_future in store_futures]
+    timings["store_wait"] = round(time.perf_counter() - start_time, 4)
+
+    timings["total"] = round(time.perf_counter() - total_start, 4)
+
+    results_list = [
+        build_result(predictions[sha256], filename, file_id, model_name, sha256 in cached_hashes)
+        for filename, sha256, file_id in zip(filenames, hashes, file_ids)
+    ]
+
+    return jsonify({
+        "results": results_list,
+        "cached": len([h for h in hashes if h in cached_hashes]),
+        "elapsed_time": timings["inference"],
+        "timings": timings,
+        "batch_size": batch_size,
+        "tiled": tiled
+    })
+
+#big uploads as a background job: returns a job id right away, results are polled or streamed with SSE
+@bp.route("/jobs", methods=["POST"])
+def submit_job():
+    files = [f for f in request.files.getlist("file") if f and f.filename != "" and allowed_file(f.filename)]
+    if not files:
+        return jsonify({"error": "No valid .jpg/.jpeg files in request"}), 400
+
+    model_name = request.form.get("model", current_app.config["MODEL_NAME"])
+    try:
+        inference.check_model(model_name)
+    except KeyError as e:
+        return jsonify({"error": str(e)}), 400
+    tiled = request.form.get("tiled") == "1"
+
+    items = []
+    for file in files:
+        filename = secure_filename(file.filename)
+        file_bytes, sha256 = read_upload(file)
+        items.append({
+            "filename": filename,
+            "sha256": sha256,
+            "bytes": file_bytes,
+            "store_future": store_upload(file_bytes, filename, sha256),
+        })
+
+    def process_chunk(chunk):
+        hashes = [item["sha256"] for item in chunk]
+        try:
+            predictions, cached_hashes = predict_uploads(
+                model_name, hashes, [item["bytes"] for item in chunk], INFERENCE_BATCH_SIZE, tiled=tiled)
+        except ValueError:
+            # one bad image shouldn't sink the others, retry them one at a time
+            if len(chunk) > 1:
+                return [result for item in chunk for result in process_chunk([item])]
+            return [{"filename": chunk[0]["filename"], "error": "Could not decode image",
+                     "file_id": str(chunk[0]["store_future"].result())}]
+        return [
+            build_result(predictions[item["sha256"]], item["filename"], item["store_future"].result(),
+                         model_name, item["sha256"] in cached_hashes)
+            for item in chunk
+        ]
+
+    job_id = jobs.submit(items, model_name, process_chunk)
+    return jsonify({"job_id": str(job_id), "total": len(items)}), 202
+
+@bp.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """Job status and results, ?after=N skips the first N results the page already has."""
+    try:
+        job = jobs.get(ObjectId(job_id), after=max(0, int(request.args.get("after", 0))))
+    except (InvalidId, ValueError):
+        return jsonify({"error": f"Invalid job id or after: {job_id}"}), 400
+    if job is None:
+        return jsonify({"error": f"Job not found: {job_id}"}), 404
+    return jsonify(job)
+
+@bp.route("/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id):
+    """
+    Server-Sent Events: one 'result' event per finished image, then 'done' (or 'failed').
+    The stream ends after JOB_EVENTS_MAX_SECONDS, EventSource reconnects and continues.
+    """
+    try:
+        job_object_id = ObjectId(job_id)
+    except InvalidId:
+        return jsonify({"error": f"Invalid job id: {job_id}"}), 400
+    if jobs.get(job_object_id, results=False) is None:
+        return jsonify({"error": f"Job not found: {job_id}"}), 404
+
+    # EventSource sends Last-Event-ID when it reconnects, so we can continue where we stopped
+    try:
+        sent = max(0, int(request.headers.get("Last-Event-ID", 0) or 0))
+    except ValueError:
+        sent = 0
+
+    def generate():
+        nonlocal sent
+        deadline = time.monotonic() + JOB_EVENTS_MAX_SECONDS
+        yield "retry: 1000\n\n"  # reconnect quickly when the stream ends at the deadline
+        while time.monotonic() < deadline:
+            job = jobs.get(job_object_id, after=sent)
+            if job is None:
+                return
+            for result in job["results"]:
+                sent += 1
+                yield f"id: {sent}\nevent: result\ndata: {dumps(result).decode('utf-8')}\n\n"
+            progress = {"completed": job["completed"], "total": job["total"], "status": job["status"]}
+            yield f"event: progress\ndata: {dumps(progress).decode('utf-8')}\n\n"
+            if job["status"] in ("done", "failed"):
+                yield f"event: {job['status']}\ndata: {dumps({'error': job['error']}).decode('utf-8')}\n\n"
+                return
+            time.sleep(JOB_POLL_SECONDS)
+
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+#queue depth and batch size stats for tuning the micro-batching scheduler
+@bp.route("/inferenceStats")
+def inference_stats():
+    if inference.is_remote():
+        try:
+            schedulers = inference_client.stats()
+        except Exception as e:
+            return jsonify({"error": f"Inference process unavailable: {e}"}), 503
+    else:
+        schedulers = inference_scheduler.all_stats()
+    return jsonify({
+        "enabled": inference.USE_INFERENCE_SCHEDULER,
+        "mode": inference.INFERENCE_MODE,
+        "schedulers": schedulers,
+        "result_cache": inference_cache.stats()
+    })
+
+#Prometheus scrape endpoint: stage timings, route latency, mongo commands and model/batch stats from every worker
+@bp.route("/metrics")
+def prometheus_metrics():
+    body, content_type = metrics.render()
+    if body is None:
+        return jsonify({"error": "Metrics need the prometheus-client package"}), 501
+    return Response(body, content_type=content_type, headers={"Cache-Control": "no-store"})
+
+#per-class counts and mean confidence for an area/time range, from the aggregates /saveResults keeps up to date
+@bp.route("/stats")
+def get_stats():
+    """
+    ?bbox=minLon,minLat,maxLon,maxLat limits the counts to the geohash cells covering the bbox,
+    ?since=/?until=YYYY-MM-DD to the days detections were saved (UTC, inclusive),
+    ?precision= picks the geohash length (default: the finest one that keeps the query small),
+    ?group=cell|day adds a breakdown per geohash cell or per day.
+    """
+    try:
+        bbox = spatial.parse_bbox(request.args["bbox"]) if "bbox" in request.args else None
+        since = stats.parse_day(request.args["since"]) if "since" in request.args else None
+        until = stats.parse_day(request.args["until"]) if "until" in request.args else None
+        precision = int(request.args["precision"]) if "precision" in request.args else None
+        group = request.args.get("group")
+        if group not in (None, "cell", "day"):
+            raise ValueError("group must be cell or day")
+        ensure_indexes()
+        result = stats.query(bbox, since, until, precision, group)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(result)
+
 #when user selects an image to save to the database from running inference
 @bp.route("/saveResults", methods=["POST"])
 def save_results():
-    client = connect_to_mongodb()
-    db = client[DATABASE_NAME]
-    collection = db[COLLECTION_NAME]
+    collection = get_collection()
 
     data = request.json
     results = data.get("results", [])
@@ -218,69 +739,59 @@ def save_results():
     if not results:
         return jsonify({"error": "No results provided"}), 400
 
-    geojson_results = []
+    # EXIF was parsed at upload and stored with the GridFS file, fetch it for every result in one query
+    try:
+        file_ids = [ObjectId(result["file_id"]) for result in results]
+    except (KeyError, InvalidId):
+        return jsonify({"error": "Every result needs a valid file_id"}), 400
+    with metrics.timed("exif_lookup"):
+        stored_metadata = {
+            doc["_id"]: doc.get("metadata", {}).get("exif")
+            for doc in get_db()["fs.files"].find({"_id": {"$in": file_ids}}, {"metadata.exif": 1})
+        }
+
+    detection_docs = []
 
-    for result in results:
+    for result, file_id in zip(results, file_ids):
         try:
-            # Retrieve image file from MongoDB GridFS
-            retrieved_file = fs.get(ObjectId(result["file_id"]))  # Convert file_id to ObjectId
-            file_bytes = retrieved_file.read()
-
-            # Extract EXIF metadata
-            stream = BytesIO(file_bytes)
-            tags = exifread.process_file(stream, details=False)
-
-            # Extract GPS data
-            lat, lon = None, None
-            if 'GPS GPSLatitude' in tags and 'GPS GPSLongitude' in tags:
-                lat = convert_to_degrees(tags['GPS GPSLatitude'], tags.get('GPS GPSLatitudeRef'))
-                lon = convert_to_degrees(tags['GPS GPSLongitude'], tags.get('GPS GPSLongitudeRef'))
-                lat = lat - LATITUDE_OFFSET if lat is not None else None
-                lon = lon - LONGITUDE_OFFSET if lon is not None else None
-
-            # Extract image direction (yaw) if available
-            yaw = "Unknown"
-            if 'GPS GPSImgDirection' in tags:
-                try:
-                    direction = tags['GPS GPSImgDirection'].values[0]
-                    yaw = float(direction.num) / float(direction.den)
-                except Exception:
-                    yaw = "Unknown"
-
-            # Extract altitude (meters) if available
-            altitude_meters = None
-            if 'GPS GPSAltitude' in tags:
-                try:
-                    altitude = tags['GPS GPSAltitude'].values[0]
-                    altitude_meters = float(altitude.num) / float(altitude.den)
-                except Exception:
-                    altitude_meters = None
-
-            # Create GeoJSON formatted result to put into database
-            geojson_results.append({
-                "type": "Feature",
-                "properties": {
-                    "filename": result["filename"],
-                    "predicted_class": result["predicted_class"],
-                    "probabilities": result["probabilities"],
-                    "file_id": result["file_id"],
-                    "lat": lat,
-                    "lon": lon,
-                    "yaw": yaw,
-                    "msl_alt": altitude_meters,
-                },
-                "geometry": {
-                    "type": "Point",
-                    "coordinates": [lon, lat] if lat is not None and lon is not None else None
-                }
-            })
+            metadata = stored_metadata.get(file_id)
+            if metadata is None:
+                # older uploads don't have it yet, the EXIF block is in the first chunk so only read that
+                metadata = read_exif_from_gridfs(file_id)
+
+            lat, lon = metadata["lat"], metadata["lon"]
+            lat = lat - LATITUDE_OFFSET if lat is not None else None
+            lon = lon - LONGITUDE_OFFSET if lon is not None else None
+
+            # compact document (see app/detections.py), /images turns it back into GeoJSON
+            detection_docs.append(detections.build_document(
+                file_id, result["filename"], lat, lon,
+                yaw=metadata["yaw"],
+                msl_alt=metadata["msl_alt"],
+                predicted_class=result["predicted_class"],
+                probabilities=result["probabilities"],
+            ))
 
         except Exception as e:
             logging.error(f"Error processing file {result['file_id']}: {e}")
 
     # Save results in MongoDB
-    if geojson_results:
-        inserted_ids = collection.insert_many(geojson_results).inserted_ids
+    if detection_docs:
+        # stamp every document with a monotonic insertion cursor for /images?since= delta sync
+        start = reserve_cursor_range(len(detection_docs))
+        for offset, doc in enumerate(detection_docs):
+            doc["seq"] = start + offset
+        try:
+            with metrics.timed("insert_many"):
+                inserted_ids = collection.insert_many(detection_docs).inserted_ids
+        finally:
+            release_cursor_range(start)  # also bumps the version, cached /images responses and tiles are now stale
+        # the detections are saved either way, a failed count only shows up in /stats until a rebuild
+        try:
+            with metrics.timed("stats_update"):
+                stats.record(detection_docs)
+        except PyMongoError as e:
+            logging.error(f"Could not update detection stats, run python -m app.stats --rebuild: {e}")
         return jsonify({"message": f"Saved {len(inserted_ids)} results to the database"})
 
     return jsonify({"error": "No valid results to save"}), 400
@@ -289,9 +800,7 @@ def save_results():
 #testing if the map was actually getting the data
 @bp.route("/test-image")
 def test_image():
-    client = connect_to_mongodb()
-    db = client[DATABASE_NAME]
-    collection = db[COLLECTION_NAME]
+    collection = get_collection()
 
     doc = collection.find_one()
     
@@ -0,0 +1,154 @@
+import os       # reading clustering settings from environment variables
+import math     # grid cell math
+
+
+# below this zoom level /images sends grid clusters instead of raw points
+CLUSTER_MAX_ZOOM = int(os.getenv("CLUSTER_MAX_ZOOM", "15"))
+# roughly how many screen pixels wide one cluster cell is (mapbox.html used clusterRadius 80)
+CLUSTER_CELL_PIXELS = int(os.getenv("CLUSTER_CELL_PIXELS", "80"))
+TILE_SIZE_PIXELS = 256
+
+
+def parse_bbox(value):
+    """Parses 'minLon,minLat,maxLon,maxLat' into floats, raising ValueError if it isn't valid."""
+    try:
+        min_lon, min_lat, max_lon, max_lat = [float(v) for v in value.split(",")]
+    except (AttributeError, ValueError):
+        raise ValueError("bbox must be minLon,minLat,maxLon,maxLat")
+    min_lon, max_lon = max(min_lon, -180.0), min(max_lon, 180.0)
+    min_lat, max_lat = max(min_lat, -90.0), min(max_lat, 90.0)
+    if min_lon >= max_lon or min_lat >= max_lat:
+        raise ValueError("bbox min values must be smaller than max values")
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def parse_zoom(value):
+    try:
+        zoom = float(value)
+    except (TypeError, ValueError):
+        raise ValueError("zoom must be a number")
+    return max(0, min(int(zoom), 24))
+
+
+def bbox_filter(bbox):
+    """MongoDB filter for points inside bbox, uses the 2dsphere index on geometry."""
+    if bbox is None:
+        return {}
+    min_lon, min_lat, max_lon, max_lat = bbox
+    if max_lon - min_lon >= 180.0:
+        # a polygon wider than a hemisphere is ambiguous on a sphere, split it in two
+        mid_lon = (min_lon + max_lon) / 2.0
+        return {"$or": [bbox_filter((min_lon, min_lat, mid_lon, max_lat)),
+                        bbox_filter((mid_lon, min_lat, max_lon, max_lat))]}
+    return {
+        "geometry": {
+            "$geoWithin": {
+                "$geometry": {
+                    "type": "Polygon",
+                    "coordinates": [[
+                        [min_lon, min_lat], [max_lon, min_lat], [max_lon, max_lat],
+                        [min_lon, max_lat], [min_lon, min_lat]
+                    ]]
+                }
+            }
+        }
+    }
+
+
+def cell_size_degrees(zoom):
+    """Width in degrees of one cluster cell at this zoom level."""
+    return 360.0 / (2 ** zoom) * CLUSTER_CELL_PIXELS / TILE_SIZE_PIXELS
+
+
+# documents with a real position ([null, null] and null coordinates from older saves are left out)
+HAS_COORDINATES = {"geometry.coordinates.0": {"$type": "number"}, "geometry.coordinates.1": {"$type": "number"}}
+
+
+def tile_cluster_grid(bbox):
+    """
+    (cell, origin, cells per side) for clustering inside one map tile: the tile is split into whole
+    cells (about CLUSTER_CELL_PIXELS wide), so no cell crosses into the neighbouring tile.
+    """
+    min_lon, min_lat, max_lon, max_lat = bbox
+    per_side = max(1, round(TILE_SIZE_PIXELS / CLUSTER_CELL_PIXELS))
+    return ((max_lon - min_lon) / per_side, (max_lat - min_lat) / per_side), (min_lon, min_lat), per_side
+
+
+def _cell_index(value, origin, size, per_side):
+    index = {"$floor": {"$divide": [{"$subtract": [value, origin]}, size]}}
+    # a point on the tile's far edge belongs to the last cell, not one past it
+    return {"$min": [index, per_side - 1]} if per_side else index
+
+
+def cluster_pipeline(match, zoom, cell=None, origin=(0.0, 0.0), per_side=None):
+    """
+    Aggregation that groups points into grid cells and counts them per predicted_class.
+    By default the cells are a world grid of cell_size_degrees(zoom); vector tiles pass their own
+    tile_cluster_grid so cells line up with the tile edges.
+    """
+    cell_x, cell_y = cell or (cell_size_degrees(zoom), cell_size_degrees(zoom))
+    lon = {"$arrayElemAt": ["$geometry.coordinates", 0]}
+    lat = {"$arrayElemAt": ["$geometry.coordinates", 1]}
+    return [
+        # only points with real coordinates can be clustered
+        {"$match": {"$and": [match, HAS_COORDINATES]} if match else HAS_COORDINATES},
+        {"$project": {
+            "lon": lon,
+            "lat": lat,
+            # "class" in compact documents, properties.predicted_class in older ones
+            "predicted_class": {"$ifNull": ["$class", {"$ifNull": ["$properties.predicted_class", "Unknown"]}]},
+        }},
+        {"$group": {
+            "_id": {
+                "x": _cell_index("$lon", origin[0], cell_x, per_side),
+                "y": _cell_index("$lat", origin[1], cell_y, per_side),
+                "predicted_class": "$predicted_class",
+            },
+            "count": {"$sum": 1},
+            "lon_sum": {"$sum": "$lon"},
+            "lat_sum": {"$sum": "$lat"},
+        }},
+        {"$group": {
+            "_id": {"x": "$_id.x", "y": "$_id.y"},
+            "count": {"$sum": "$count"},
+            "lon_sum": {"$sum": "$lon_sum"},
+            "lat_sum": {"$sum": "$lat_sum"},
+            "class_counts": {"$push": {"k": {"$toString": "$_id.predicted_class"}, "v": "$count"}},
+        }},
+        {"$project": {
+            "count": 1,
+            "lon": {"$divide": ["$lon_sum", "$count"]},
+            "lat": {"$divide": ["$lat_sum", "$count"]},
+            "class_counts": {"$arrayToObject": "$class_counts"},
+        }},
+    ]
+
+
+def abbreviate(count):
+    """Same style as mapbox's point_count_abbreviated (e.g. 1.2k)."""
+    if count >= 10000:
+        return f"{round(count / 1000)}k"
+    if count >= 1000:
+        return f"{math.floor(count / 100) / 10:g}k"
+    return str(count)
+
+
+def cluster_feature(doc, zoom, id_prefix=None):
+    """
+    GeoJSON Feature for one grid cell, using the same property names as mapbox's own clusters.
+    id_prefix (the tile) keeps ids unique when the cell indexes are counted per tile.
+    """
+    return {
+        "type": "Feature",
+        "properties": {
+            "cluster": True,
+            "cluster_id": f"{id_prefix or zoom}/{int(doc['_id']['x'])}/{int(doc['_id']['y'])}",
+            "point_count": doc["count"],
+            "point_count_abbreviated": abbreviate(doc["count"]),
+            "class_counts": doc["class_counts"],
+        },
+        "geometry": {
+            "type": "Point",
+            "coordinates": [doc["lon"], doc["lat"]]
+        }
+    }
@@ -0,0 +1,295 @@
+"""
+Per-area, per-class detection counts for /stats, kept up to date on every /saveResults insert
+instead of being counted from the detection collection on each request.
+
+Every classified detection adds 1 (and its confidence) to one aggregate document per geohash
+precision: {_id, p, gh, day, class, count, conf_sum, conf_n}. p=0 / gh="" holds the totals for
+all detections, including those without GPS. A query only reads the aggregates of the cells that
+cover the requested bbox, so it costs the same for 1,000 or 10,000,000 stored detections.
+
+    python -m app.stats --rebuild   # recount everything (first deploy, or after editing detections by hand)
+"""
+import os       # settings from environment variables
+import time     # rebuild speed
+import logging  # progress and errors
+import datetime  # detections are counted per UTC day
+from pymongo import UpdateOne  # one upsert per cell/day/class
+from .db import get_db, get_collection
+from . import detections  # compact/legacy detection documents
+
+
+STATS_COLLECTION = "detectionStats"
+# geohash lengths aggregates are kept at: 4 ~ 39x20 km, 5 ~ 4.9x4.9 km, 6 ~ 1.2x0.6 km, 7 ~ 153x153 m, 8 ~ 38x19 m
+STATS_PRECISIONS = sorted(int(p) for p in os.getenv("STATS_GEOHASH_PRECISIONS", "4,5,6,7,8").split(","))
+# a bbox query reads at most this many cells, the finest precision that stays under it is used
+STATS_MAX_CELLS = int(os.getenv("STATS_MAX_CELLS", "2500"))
+REBUILD_BATCH_SIZE = 5000
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_BASE32_INDEX = {c: i for i, c in enumerate(_BASE32)}
+
+
+def _bits(precision):
+    """(longitude bits, latitude bits) of a geohash this long, longitude gets the odd bit."""
+    return (5 * precision + 1) // 2, 5 * precision // 2
+
+
+def _cell_index(lon, lat, precision):
+    """(x, y) of the cell that contains the point, counted from -180/-90."""
+    lon_bits, lat_bits = _bits(precision)
+    x = int((lon + 180.0) / 360.0 * (1 << lon_bits))
+    y = int((lat + 90.0) / 180.0 * (1 << lat_bits))
+    return min(max(x, 0), (1 << lon_bits) - 1), min(max(y, 0), (1 << lat_bits) - 1)
+
+
+def _encode_index(x, y, precision):
+    """Geohash of cell (x, y): longitude and latitude bits interleaved, longitude first, 5 bits per character."""
+    lon_bits, lat_bits = _bits(precision)
+    value = 0
+    for i in range(5 * precision):
+        if i % 2 == 0:
+            lon_bits -= 1
+            value = value << 1 | (x >> lon_bits) & 1
+        else:
+            lat_bits -= 1
+            value = value << 1 | (y >> lat_bits) & 1
+    return "".join(_BASE32[(value >> shift) & 31] for shift in range(5 * (precision - 1), -1, -5))
+
+
+def encode(lon, lat, precision):
+    return _encode_index(*_cell_index(lon, lat, precision), precision)
+
+
+def cell_bbox(geohash):
+    """(minLon, minLat, maxLon, maxLat) of a geohash cell."""
+    value = 0
+    for c in geohash:
+        value = value << 5 | _BASE32_INDEX[c]
+    x = y = 0
+    for i in range(5 * len(geohash)):
+        bit = (value >> (5 * len(geohash) - 1 - i)) & 1
+        if i % 2 == 0:
+            x = x << 1 | bit
+        else:
+            y = y << 1 | bit
+    lon_bits, lat_bits = _bits(len(geohash))
+    width, height = 360.0 / (1 << lon_bits), 180.0 / (1 << lat_bits)
+    return (x * width - 180.0, y * height - 90.0, (x + 1) * width - 180.0, (y + 1) * height - 90.0)
+
+
+def _covering_range(bbox, precision):
+    """Cell index ranges (x0, x1, y0, y1) of the cells a bbox touches."""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    x0, y0 = _cell_index(min_lon, min_lat, precision)
+    x1, y1 = _cell_index(max_lon, max_lat, precision)
+    return x0, x1, y0, y1
+
+
+def covering_cells(bbox, precision):
+    """Geohashes of every cell the bbox touches, and the area those cells cover together."""
+    x0, x1, y0, y1 = _covering_range(bbox, precision)
+    cells = [_encode_index(x, y, precision) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+    lon_bits, lat_bits = _bits(precision)
+    width, height = 360.0 / (1 << lon_bits), 180.0 / (1 << lat_bits)
+    area = (x0 * width - 180.0, y0 * height - 90.0, (x1 + 1) * width - 180.0, (y1 + 1) * height - 90.0)
+    return cells, area
+
+
+def cell_count(bbox, precision):
+    x0, x1, y0, y1 = _covering_range(bbox, precision)
+    return (x1 - x0 + 1) * (y1 - y0 + 1)
+
+
+def choose_precision(bbox):
+    """Finest stored precision whose covering cells stay under STATS_MAX_CELLS (or the coarsest one)."""
+    fitting = [p for p in STATS_PRECISIONS if cell_count(bbox, p) <= STATS_MAX_CELLS]
+    return fitting[-1] if fitting else STATS_PRECISIONS[0]
+
+
+def parse_day(value):
+    """'YYYY-MM-DD' (or a full ISO timestamp) -> midnight UTC of that day, raising ValueError if it isn't valid."""
+    try:
+        day = datetime.datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError("dates must be YYYY-MM-DD")
+    return datetime.datetime(day.year, day.month, day.day)
+
+
+def _day_of(doc):
+    """UTC day a detection was saved, from its ObjectId (every insert path gives one)."""
+    created = doc["_id"].generation_time if hasattr(doc.get("_id"), "generation_time") else \
+        datetime.datetime.now(datetime.timezone.utc)
+    return datetime.datetime(created.year, created.month, created.day)
+
+
+def _add(totals, docs):
+    """Sums docs into totals: (geohash, day, class) -> [count, conf_sum, conf_n]."""
+    for doc in docs:
+        if not detections.is_compact(doc):
+            doc = detections.from_legacy(doc)
+        predicted_class = doc.get("class")
+        if predicted_class is None:
+            continue  # ingested but never classified
+        day = _day_of(doc)
+        cells = [""]
+        if "geometry" in doc:
+            lon, lat = doc["geometry"]["coordinates"]
+            finest = encode(lon, lat, STATS_PRECISIONS[-1])
+            cells.extend(finest[:p] for p in STATS_PRECISIONS)
+        conf = doc.get("conf")
+        for geohash in cells:
+            entry = totals.setdefault((geohash, day, predicted_class), [0, 0.0, 0])
+            entry[0] += 1
+            if conf is not None:
+                entry[1] += conf
+                entry[2] += 1
+    return totals
+
+
+def _upserts(totals):
+    return [
+        UpdateOne(
+            {"_id": f"{geohash}|{day:%Y-%m-%d}|{predicted_class}"},
+            {"$inc": {"count": count, "conf_sum": conf_sum, "conf_n": conf_n},
+             "$setOnInsert": {"p": len(geohash), "gh": geohash, "day": day, "class": predicted_class}},
+            upsert=True,
+        )
+        for (geohash, day, predicted_class), (count, conf_sum, conf_n) in totals.items()
+    ]
+
+
+def record(docs, collection_name=STATS_COLLECTION):
+    """Adds freshly inserted detection documents (with their _id) to the aggregates."""
+    requests = _upserts(_add({}, docs))
+    if requests:
+        get_db()[collection_name].bulk_write(requests, ordered=False)
+    return len(requests)
+
+
+def ensure_stats_indexes(db):
+    # bbox queries: one precision, a set of cells, optionally a day range
+    db[STATS_COLLECTION].create_index([("p", 1), ("gh", 1), ("day", 1)], name="p_gh_day")
+    # grid/total queries over a time range without a bbox
+    db[STATS_COLLECTION].create_index([("p", 1), ("day", 1)], name="p_day")
+
+
+def _summary(rows):
+    """{class: {count, mean_conf}} and the total count from grouped aggregate rows."""
+    classes, total = {}, 0
+    for row in rows:
+        classes[row["class"]] = {
+            "count": row["count"],
+            "mean_conf": round(row["conf_sum"] / row["conf_n"], 4) if row["conf_n"] else None,
+        }
+        total += row["count"]
+    return dict(sorted(classes.items())), total
+
+
+def query(bbox=None, since=None, until=None, precision=None, group=None):
+    """
+    Per-class counts and mean confidence from the aggregates.
+    bbox is counted by whole cells, so the result covers "area" (the bbox grown to cell edges).
+    group="cell" also returns the breakdown per geohash cell, group="day" per day.
+    """
+    if precision is not None and precision not in STATS_PRECISIONS:
+        raise ValueError(f"precision must be one of {STATS_PRECISIONS}")
+    area = None
+    if bbox is not None:
+        precision = precision or choose_precision(bbox)
+        if cell_count(bbox, precision) > STATS_MAX_CELLS:
+            raise ValueError(f"bbox covers more than {STATS_MAX_CELLS} cells at precision {precision}, "
+                             "use a coarser precision")
+        cells, area = covering_cells(bbox, precision)
+        match = {"p": precision, "gh": {"$in": cells}}
+    elif group == "cell":
+        precision = precision or STATS_PRECISIONS[0]
+        match = {"p": precision}
+    else:
+        precision = 0
+        match = {"p": 0}
+    if since is not None or until is not None:
+        match["day"] = {}
+        if since is not None:
+            match["day"]["$gte"] = since
+        if until is not None:
+            match["day"]["$lte"] = until
+
+    key = {"class": "$class"}
+    if group == "cell":
+        key["gh"] = "$gh"
+    elif group == "day":
+        key["day"] = "$day"
+    rows = get_db()[STATS_COLLECTION].aggregate([
+        {"$match": match},
+        {"$group": {"_id": key, "count": {"$sum": "$count"},
+                    "conf_sum": {"$sum": "$conf_sum"}, "conf_n": {"$sum": "$conf_n"}}},
+    ])
+    rows = [{**row["_id"], **row} for row in rows]
+
+    classes, total = _summary(rows)
+    result = {
+        "precision": precision,
+        "area": list(area) if area is not None else None,
+        "since": f"{since:%Y-%m-%d}" if since is not None else None,
+        "until": f"{until:%Y-%m-%d}" if until is not None else None,
+        "total": total,
+        "classes": classes,
+    }
+    if group == "cell":
+        by_cell = {}
+        for row in rows:
+            by_cell.setdefault(row["gh"], []).append(row)
+        result["cells"] = []
+        for geohash in sorted(by_cell):
+            cell_classes, cell_total = _summary(by_cell[geohash])
+            result["cells"].append({"geohash": geohash, "bbox": list(cell_bbox(geohash)),
+                                    "total": cell_total, "classes": cell_classes})
+    elif group == "day":
+        by_day = {}
+        for row in rows:
+            by_day.setdefault(row["day"], []).append(row)
+        result["days"] = []
+        for day in sorted(by_day):
+            day_classes, day_total = _summary(by_day[day])
+            result["days"].append({"day": f"{day:%Y-%m-%d}", "total": day_total, "classes": day_classes})
+    return result
+
+
+def rebuild(batch_size=REBUILD_BATCH_SIZE):
+    """
+    Recounts the aggregates from the detection collection into a new collection and swaps it in.
+    Detections saved while this runs may be missed, run it when nobody is saving results.
+    """
+    db = get_db()
+    target = f"{STATS_COLLECTION}_rebuild"
+    db[target].drop()
+    start_time = time.perf_counter()
+    projection = {"_id": 1, "schema": 1, "class": 1, "conf": 1, "geometry.coordinates": 1,
+                  "properties.predicted_class": 1, "properties.probabilities": 1,
+                  "properties.lat": 1, "properties.lon": 1}
+    scanned, totals = 0, {}
+    for doc in get_collection().find({}, projection, batch_size=batch_size):
+        _add(totals, [doc])
+        scanned += 1
+        if scanned % batch_size == 0:
+            logging.info(f"{scanned} detections scanned")
+    requests = _upserts(totals)
+    for i in range(0, len(requests), batch_size):
+        db[target].bulk_write(requests[i:i + batch_size], ordered=False)
+    if totals:
+        db[target].rename(STATS_COLLECTION, dropTarget=True)
+    else:
+        db[STATS_COLLECTION].delete_many({})
+    ensure_stats_indexes(db)
+    logging.info(f"Rebuilt {len(totals)} aggregates from {scanned} detections "
+                 f"in {time.perf_counter() - start_time:.1f}s")
+    return len(totals)
+
+
+if __name__ == "__main__":
+    import sys
+    logging.basicConfig(level=logging.INFO)
+    if "--rebuild" in sys.argv:
+        rebuild()
+    else:
+        print(__doc__)
@@ -0,0 +1,172 @@
+import os       # tile cache folder and settings from environment variables
+import math     # web mercator tile math
+import logging  # reporting cache problems
+import tempfile  # writing cache files atomically
+import threading  # counting cache writes safely between request threads
+
+try:
+    import mapbox_vector_tile  # encodes features into the .mvt protobuf format
+except ImportError:
+    mapbox_vector_tile = None
+
+
+TILE_EXTENT = 4096  # coordinate range inside one tile (mapbox default)
+TILE_BUFFER = 64    # features this close outside the tile are included so icons don't get cut at edges
+TILE_MAX_ZOOM = int(os.getenv("TILE_MAX_ZOOM", "22"))
+TILE_LAYER_NAME = "detections"
+
+# on-disk cache so every gunicorn worker sees the same tiles, kept per collection version
+TILE_CACHE_DIR = os.getenv("TILE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "tile_cache"))
+TILE_CACHE_MAX_TILES = int(os.getenv("TILE_CACHE_MAX_TILES", "20000"))
+PRUNE_EVERY_WRITES = 256
+
+_writes = 0
+_writes_lock = threading.Lock()
+
+
+def tile_bbox(z, x, y, buffer=0):
+    """(minLon, minLat, maxLon, maxLat) covered by tile z/x/y, optionally grown by buffer tile units."""
+    n = 2 ** z
+    pad = buffer / TILE_EXTENT
+
+    def lon(tx):
+        return tx / n * 360.0 - 180.0
+
+    def lat(ty):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+
+    return (max(lon(x - pad), -180.0), max(lat(y + 1 + pad), -85.0511),
+            min(lon(x + 1 + pad), 180.0), min(lat(y - pad), 85.0511))
+
+
+def lonlat_to_tile_fraction(lon, lat, z):
+    """Fractional tile x/y of a point at zoom z."""
+    n = 2 ** z
+    lat = max(min(lat, 85.0511), -85.0511)
+    lat_rad = math.radians(lat)
+    tx = (lon + 180.0) / 360.0 * n
+    ty = (1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n
+    return tx, ty
+
+
+def valid_tile(z, x, y):
+    return 0 <= z <= TILE_MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def _clean_properties(properties):
+    """Vector tiles can't hold nulls or lists, so drop the nulls and flatten lists to strings."""
+    cleaned = {}
+    for key, value in properties.items():
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple)):
+            value = ",".join(str(v) for v in value)
+        elif isinstance(value, dict):
+            # class_counts on clusters -> one property per class
+            for sub_key, sub_value in value.items():
+                cleaned[f"{key}_{sub_key}"] = sub_value
+            continue
+        cleaned[key] = value
+    return cleaned
+
+
+def encode_tile(features, z, x, y):
+    """Encodes GeoJSON point features into one .mvt tile."""
+    if mapbox_vector_tile is None:
+        raise RuntimeError("mapbox-vector-tile is not installed")
+
+    tile_features = []
+    for feature in features:
+        geometry = feature.get("geometry")
+        if not geometry or not geometry.get("coordinates") or None in geometry["coordinates"]:
+            continue
+        lon, lat = geometry["coordinates"][:2]
+        tx, ty = lonlat_to_tile_fraction(lon, lat, z)
+        px = int(round((tx - x) * TILE_EXTENT))
+        py = int(round((ty - y) * TILE_EXTENT))
+        tile_features.append({
+            "geometry": f"POINT({px} {py})",
+            "properties": _clean_properties(feature["properties"]),
+        })
+
+    return mapbox_vector_tile.encode(
+        [{"name": TILE_LAYER_NAME, "features": tile_features}],
+        default_options={"extents": TILE_EXTENT, "y_coord_down": True},
+    )
+
+
+def _tile_path(version, z, x, y):
+    # every collection version gets its own folder, tiles of older versions are never read again
+    return os.path.join(TILE_CACHE_DIR, version, str(z), str(x), f"{y}.mvt")
+
+
+def get_cached(version, z, x, y):
+    """Returns the cached tile bytes for this collection version (db.get_collection_version) or None."""
+    path = _tile_path(version, z, x, y)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    try:
+        os.utime(path)  # mark as recently used for pruning
+    except OSError:
+        pass
+    return data
+
+
+def put_cached(version, z, x, y, data):
+    """
+    Caches a tile under the collection version read before its data. A save, ingest, migration
+    or delete changes the version, so tiles built before it are simply never looked up again.
+    """
+    global _writes
+    path = _tile_path(version, z, x, y)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temp file and rename so other workers never read half a tile
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logging.warning(f"Could not cache tile {z}/{x}/{y}: {e}")
+        return
+
+    with _writes_lock:
+        _writes += 1
+        prune = _writes % PRUNE_EVERY_WRITES == 0
+    if prune:
+        prune_cache()
+
+
+def prune_cache():
+    """
+    Deletes the least recently used tiles once the cache holds more than TILE_CACHE_MAX_TILES
+    (tiles of older collection versions aren't used anymore, so they go first).
+    """
+    tiles = []
+    for folder, _, filenames in os.walk(TILE_CACHE_DIR):
+        for filename in filenames:
+            if filename.endswith(".mvt"):
+                path = os.path.join(folder, filename)
+                try:
+                    tiles.append((os.path.getmtime(path), path))
+                except OSError:
+                    pass
+    if len(tiles) <= TILE_CACHE_MAX_TILES:
+        return
+    tiles.sort()
+    # drop down to 90% so we don't prune again on the very next write
+    for _, path in tiles[:len(tiles) - int(TILE_CACHE_MAX_TILES * 0.9)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    # folders of older versions that are empty now
+    for folder, _, _ in os.walk(TILE_CACHE_DIR, topdown=False):
+        if folder != TILE_CACHE_DIR:
+            try:
+                os.rmdir(folder)
+            except OSError:
+                pass  # not empty
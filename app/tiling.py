@@ -0,0 +1,157 @@
+import os       # tiling settings from environment variables
+import math     # projecting tile centers onto the ground
+import numpy as np  # strided tile views and probability grids
+from numpy.lib.stride_tricks import sliding_window_view  # every tile as a view into the decoded frame
+
+
+# How much neighbouring tiles overlap (share of the tile size)
+TILE_OVERLAP = float(os.getenv("TILE_OVERLAP", "0.25"))
+# Tile size in pixels, fixed so the grid is the same with local and remote inference (multiple of 32)
+TILED_TILE_SIZE = int(os.getenv("TILED_TILE_SIZE", "224"))
+# Short side the frame is decoded at before tiling, together with TILED_TILE_SIZE this sets how much
+# ground each tile covers: 896 x 1344 with 224 px tiles gives a 5 x 8 grid, and a 20 MP frame
+# (decoded at 1/4, 912 x 1368) gives 6 x 8
+TILED_DECODE_MIN_SIDE = int(os.getenv("TILED_DECODE_MIN_SIDE", "896"))
+# Image counts as this class when any one tile is at least TILED_THRESHOLD sure of it
+# (a small patch of purple loosestrife shouldn't be averaged away). Empty = use the mean over tiles.
+TILED_TARGET_CLASS = os.getenv("TILED_TARGET_CLASS", "purple_loosestrife")
+TILED_THRESHOLD = float(os.getenv("TILED_THRESHOLD", "0.5"))
+
+if TILED_TILE_SIZE % 32:
+    raise ValueError(f"TILED_TILE_SIZE must be a multiple of 32, got {TILED_TILE_SIZE}")
+
+# Camera/flight numbers for putting tiles on the map (Skydio X2E, nadir shots at ~20 ft)
+CAMERA_HFOV_DEG = float(os.getenv("CAMERA_HFOV_DEG", "75"))
+FLIGHT_AGL_METERS = float(os.getenv("FLIGHT_AGL_METERS", "6.1"))
+# when set, AGL is taken as EXIF altitude minus this instead of the fixed FLIGHT_AGL_METERS
+GROUND_ELEVATION_M = os.getenv("GROUND_ELEVATION_M", "")
+
+METERS_PER_DEGREE_LAT = 111320.0
+
+
+def tile_grid(length, tile_size, overlap=TILE_OVERLAP):
+    """
+    Number of tiles, stride and starting offset along one side. The stride is the same for every
+    tile (so the tiles stay a strided view) and the few leftover pixels are split between both edges.
+    """
+    if length <= tile_size:
+        return 1, tile_size, 0
+    max_stride = max(1, int(tile_size * (1 - overlap)))
+    count = math.ceil((length - tile_size) / max_stride) + 1
+    stride = (length - tile_size) // (count - 1)
+    offset = (length - tile_size - stride * (count - 1)) // 2
+    return count, stride, offset
+
+
+def extract_tiles(image, tile_size, overlap=TILE_OVERLAP):
+    """
+    Overlapping tile_size x tile_size tiles of a BGR image, without copying any pixels.
+    Returns (tiles, grid) where tiles is a (rows, cols, 3, tile_size, tile_size) view into image
+    and grid describes the layout in image pixels.
+    """
+    height, width = image.shape[:2]
+    if min(height, width) < tile_size:
+        raise ValueError(f"Image is {width}x{height}, smaller than one {tile_size} px tile")
+    rows, stride_y, offset_y = tile_grid(height, tile_size, overlap)
+    cols, stride_x, offset_x = tile_grid(width, tile_size, overlap)
+    windows = sliding_window_view(image, (tile_size, tile_size), axis=(0, 1))
+    tiles = windows[offset_y::stride_y, offset_x::stride_x][:rows, :cols]
+    grid = {
+        "rows": rows,
+        "cols": cols,
+        "tile_size": tile_size,
+        "stride": [stride_y, stride_x],
+        "offset": [offset_y, offset_x],
+        "image_size": [height, width],
+    }
+    return tiles, grid
+
+
+def tile_centers(grid):
+    """Tile centers as fractions of the frame (x right, y down), shape (rows, cols, 2)."""
+    height, width = grid["image_size"]
+    half = grid["tile_size"] / 2
+    ys = (grid["offset"][0] + np.arange(grid["rows"]) * grid["stride"][0] + half) / height
+    xs = (grid["offset"][1] + np.arange(grid["cols"]) * grid["stride"][1] + half) / width
+    return np.stack(np.meshgrid(xs, ys), axis=-1)
+
+
+def flight_agl(msl_alt):
+    """Height above ground for the ground projection, in meters."""
+    if GROUND_ELEVATION_M and msl_alt is not None:
+        agl = msl_alt - float(GROUND_ELEVATION_M)
+        if agl > 0:
+            return agl
+    return FLIGHT_AGL_METERS
+
+
+def project_tiles(grid, metadata):
+    """
+    Approximate ground position of every tile center, assuming a nadir camera whose image top points
+    along the EXIF yaw (north when the yaw is unknown). Returns (rows x cols x [lon, lat], ground
+    width of one tile in meters), or (None, None) when the image has no GPS position.
+    """
+    lat, lon = metadata.get("lat"), metadata.get("lon")
+    if lat is None or lon is None:
+        return None, None
+    height, width = grid["image_size"]
+    footprint_width = 2 * flight_agl(metadata.get("msl_alt")) * math.tan(math.radians(CAMERA_HFOV_DEG) / 2)
+    footprint_height = footprint_width * height / width
+
+    fractions = tile_centers(grid)
+    right = (fractions[..., 0] - 0.5) * footprint_width     # meters right of the image center
+    forward = (0.5 - fractions[..., 1]) * footprint_height  # meters towards the image top
+
+    yaw = metadata.get("yaw")
+    heading = math.radians(yaw) if isinstance(yaw, (int, float)) else 0.0
+    east = forward * math.sin(heading) + right * math.cos(heading)
+    north = forward * math.cos(heading) - right * math.sin(heading)
+
+    lats = lat + north / METERS_PER_DEGREE_LAT
+    lons = lon + east / (METERS_PER_DEGREE_LAT * math.cos(math.radians(lat)))
+    centers = np.round(np.stack([lons, lats], axis=-1), 7)
+    return centers.tolist(), round(footprint_width * grid["tile_size"] / width, 3)
+
+
+def aggregate(probabilities, names):
+    """
+    Image-level prediction from the (rows, cols, classes) tile probabilities: the target class
+    when any tile reaches TILED_THRESHOLD for it, otherwise the best class of the mean over tiles.
+    """
+    flat = probabilities.reshape(-1, probabilities.shape[-1])
+    mean = flat.mean(axis=0)
+    top_index = int(mean.argmax())
+    if TILED_TARGET_CLASS in names:
+        target_index = names.index(TILED_TARGET_CLASS)
+        if flat[:, target_index].max() >= TILED_THRESHOLD:
+            top_index = target_index
+    return {
+        "predicted_class": names[top_index],
+        "probabilities": mean.tolist(),
+        "top_index": top_index,
+    }
+
+
+def classify_tiled(predict_tiles, image, metadata, tile_size=TILED_TILE_SIZE):
+    """
+    Sliding-window classification of one BGR image. predict_tiles gets the tile view and returns
+    {"names": [...], "probabilities": tiles x classes}. Returns the usual prediction dict
+    (aggregated over tiles) with the per-tile heatmap under "tiles".
+    """
+    tiles, grid = extract_tiles(image, tile_size)
+    output = predict_tiles(tiles)
+    names = list(output["names"])
+    probabilities = np.asarray(output["probabilities"], dtype=np.float32).reshape(grid["rows"], grid["cols"], -1)
+
+    prediction = aggregate(probabilities, names)
+    centers, tile_ground_m = project_tiles(grid, metadata)
+    prediction["tiles"] = {
+        **grid,
+        "names": names,
+        "grid": np.round(probabilities, 4).tolist(),          # rows x cols x classes
+        "top_grid": probabilities.argmax(axis=-1).tolist(),   # rows x cols class index
+        "max_probabilities": np.round(probabilities.reshape(-1, len(names)).max(axis=0), 4).tolist(),
+        "centers": centers,
+        "tile_ground_m": tile_ground_m,
+    }
+    return prediction
@@ -0,0 +1,283 @@
+"""
+Repeatable latency/throughput benchmark for the main Flask endpoints.
+
+Seeds a throwaway database (MONGO_DATABASE, never the real one) with synthetic geotagged JPEGs and
+detection documents at each scale, starts the app under gunicorn against it (or uses --url), fires
+--requests requests per endpoint at each concurrency level and writes p50/p95/p99 latency and
+throughput to a JSON file that can be compared with an earlier run (--baseline).
+
+    python -m benchmarks.run_benchmarks --scales 1000,10000 --concurrency 1,8,32
+    python -m benchmarks.run_benchmarks --baseline benchmarks/results/old.json
+
+Needs a mongod at MONGO_URI (default mongodb://localhost:27017/) and the app's requirements.
+"""
+import os       # environment for the server and the database name
+import sys      # running gunicorn with this interpreter
+import json     # machine-readable results
+import time     # latency measurements
+import random   # picking file ids / bboxes per request
+import platform  # recording where the numbers came from
+import argparse
+import tempfile  # tile cache directory for the benchmark server
+import threading  # one HTTP session per load thread
+import subprocess  # starting the app under gunicorn
+from concurrent.futures import ThreadPoolExecutor  # concurrent clients
+import numpy as np  # percentiles and random data
+import requests  # HTTP client
+
+from . import seed_data
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+PRODUCTION_DATABASE = "seniorDesignTesting"
+ENDPOINTS = ["images", "images_bbox", "stats_bbox", "getImage", "getImage_thumb", "runInferenceTest", "saveResults"]
+# settings that change the numbers, recorded with every run
+RECORDED_ENV = [
+    "INFERENCE_MODE", "MODEL_BACKEND", "USE_INFERENCE_SCHEDULER", "SCHEDULER_MAX_BATCH_SIZE",
+    "SCHEDULER_MAX_WAIT_MS", "TORCH_NUM_THREADS", "USE_GZIP", "REDUCED_DECODE", "MONGO_MAX_POOL_SIZE",
+]
+
+
+def percentile(values, q):
+    return round(float(np.percentile(values, q)), 2) if values else None
+
+
+def run_load(make_request, total, concurrency):
+    """Runs total requests with concurrency threads, returns latency percentiles (ms) and throughput."""
+    local = threading.local()
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def one(i):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        start_time = time.perf_counter()
+        try:
+            response = make_request(session, i)
+            response.content  # include reading the whole body
+            ok = response.status_code < 400
+        except requests.RequestException:
+            ok = False
+        elapsed = (time.perf_counter() - start_time) * 1000.0
+        with lock:
+            (latencies if ok else errors).append(elapsed)
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    wall_time = time.perf_counter() - start_time
+
+    return {
+        "requests": total,
+        "errors": len(errors),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "mean_ms": round(float(np.mean(latencies)), 2) if latencies else None,
+        "throughput_rps": round(len(latencies) / wall_time, 2) if wall_time else None,
+        "wall_time_s": round(wall_time, 3),
+    }
+
+
+def endpoint_requests(base_url, images, uploads, save_batch):
+    """name -> function(session, request number) that sends one request to that endpoint."""
+    file_ids = [str(file_id) for file_id, _ in images]
+
+    def random_bbox():
+        # roughly a zoomed-in map view somewhere inside the seeded area
+        lat, lon = seed_data.random_position(random)
+        return f"{lon - 0.01:.5f},{lat - 0.01:.5f},{lon + 0.01:.5f},{lat + 0.01:.5f}"
+
+    def save_payload():
+        results = []
+        for file_id in random.sample(file_ids, min(save_batch, len(file_ids))):
+            probabilities = [round(random.random(), 4) for _ in seed_data.CLASSES]
+            results.append({
+                "filename": f"bench_{file_id}.jpg",
+                "predicted_class": seed_data.CLASSES[probabilities.index(max(probabilities))],
+                "probabilities": probabilities,
+                "file_id": file_id,
+            })
+        return {"results": results}
+
+    return {
+        "images": lambda s, i: s.get(f"{base_url}/images"),
+        "images_bbox": lambda s, i: s.get(f"{base_url}/images", params={"bbox": random_bbox(), "zoom": 14}),
+        "stats_bbox": lambda s, i: s.get(f"{base_url}/stats", params={"bbox": random_bbox()}),
+        "getImage": lambda s, i: s.get(f"{base_url}/getImage/{random.choice(file_ids)}"),
+        "getImage_thumb": lambda s, i: s.get(f"{base_url}/getImage/{random.choice(file_ids)}", params={"size": "thumb"}),
+        "runInferenceTest": lambda s, i: s.post(
+            f"{base_url}/runInferenceTest",
+            files={"file": (f"upload_{i}.jpg", uploads[i % len(uploads)], "image/jpeg")}),
+        "saveResults": lambda s, i: s.post(f"{base_url}/saveResults", json=save_payload()),
+    }
+
+
+def wait_for_health(base_url, process=None, timeout=300):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError("Benchmark server exited during startup")
+        try:
+            if requests.get(f"{base_url}/health", timeout=2).status_code < 500:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{base_url} did not come up within {timeout}s")
+
+
+def start_server(args, tile_cache_dir):
+    """Starts gunicorn on the benchmark database, returns (process, base url, seconds until /health answered)."""
+    env = dict(os.environ, MONGO_DATABASE=args.database, TILE_CACHE_DIR=tile_cache_dir)
+    command = [
+        sys.executable, "-m", "gunicorn", "-b", f"127.0.0.1:{args.port}",
+        "-w", str(args.workers), "--threads", str(args.threads), "--timeout", "300",
+        "application:create_app()",
+    ]
+    start_time = time.perf_counter()
+    process = subprocess.Popen(command, cwd=REPO_ROOT, env=env)
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_for_health(base_url, process)
+    except Exception:
+        process.terminate()
+        raise
+    return process, base_url, round(time.perf_counter() - start_time, 3)
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    """Prints p50/p95/throughput changes against an earlier results file."""
+    with open(baseline_path) as f:
+        baseline = {(r["scale"], r["endpoint"], r["concurrency"]): r for r in json.load(f)["results"]}
+    print(f"\nChange vs {baseline_path} (negative latency = faster):")
+    for result in results:
+        old = baseline.get((result["scale"], result["endpoint"], result["concurrency"]))
+        if old is None:
+            continue
+        changes = []
+        for key in ("p50_ms", "p95_ms", "throughput_rps"):
+            if old.get(key) and result.get(key) is not None:
+                changes.append(f"{key} {(result[key] - old[key]) / old[key]:+.1%}")
+        print(f"  {result['scale']:>7} {result['endpoint']:<18} c={result['concurrency']:<3} {', '.join(changes)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Flask endpoints against synthetic data.")
+    parser.add_argument("--scales", default="1000,10000,100000", help="detection document counts to seed")
+    parser.add_argument("--concurrency", default="1,8,32", help="concurrent clients to test with")
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint and concurrency level")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="which of " + ", ".join(ENDPOINTS))
+    parser.add_argument("--images", type=int, default=200, help="synthetic JPEGs stored in GridFS")
+    parser.add_argument("--image-size", default="1368x912", help="WxH of the stored images")
+    parser.add_argument("--upload-size", default="1920x1280", help="WxH of the images sent to /runInferenceTest")
+    parser.add_argument("--save-batch", type=int, default=10, help="results per /saveResults request")
+    parser.add_argument("--database", default="seniorDesignBenchmark", help="throwaway database to seed")
+    parser.add_argument("--url", default=None, help="benchmark a server that is already running on --database")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers for the started server")
+    parser.add_argument("--threads", type=int, default=4, help="gunicorn threads per worker")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="results file (default benchmarks/results/bench-<time>.json)")
+    parser.add_argument("--baseline", default=None, help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    if args.database == PRODUCTION_DATABASE:
+        parser.error("refusing to seed synthetic data into the real database")
+    os.environ["MONGO_DATABASE"] = args.database
+    from app.db import get_client, get_fs, get_collection, ensure_indexes  # reads MONGO_DATABASE
+    from app import stats  # seeded detections bypass /saveResults, their aggregates are rebuilt
+
+    scales = [int(s) for s in args.scales.split(",")]
+    levels = [int(c) for c in args.concurrency.split(",")]
+    endpoints = [e for e in args.endpoints.split(",") if e]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+    width, height = (int(v) for v in args.image_size.split("x"))
+    upload_width, upload_height = (int(v) for v in args.upload_size.split("x"))
+
+    random.seed(args.seed)
+    rng = np.random.default_rng(args.seed)
+
+    # start from an empty benchmark database every run so results are comparable
+    get_client().drop_database(args.database)
+    ensure_indexes()
+    print(f"Seeding {args.images} images into {args.database}...")
+    images = seed_data.seed_images(get_fs(), args.images, width, height, rng)
+    # filled with new images before every /runInferenceTest level, see below
+    uploads = []
+
+    run = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": git_commit(),
+        "host": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": {**vars(args), "env": {name: os.environ[name] for name in RECORDED_ENV if name in os.environ}},
+        "startup_s": {},
+        "results": [],
+    }
+
+    for scale in scales:
+        # /saveResults from the previous scale added documents, start each scale at exactly scale docs
+        collection = get_collection()
+        if collection.estimated_document_count() > scale:
+            collection.delete_many({})
+        count = seed_data.seed_detections(collection, images, scale, rng)
+        stats.rebuild()
+        print(f"\n== {count} detection documents ==")
+
+        # a fresh server per scale so in-memory caches don't carry over
+        process = None
+        with tempfile.TemporaryDirectory() as tile_cache_dir:
+            if args.url:
+                base_url = args.url.rstrip("/")
+            else:
+                process, base_url, startup = start_server(args, tile_cache_dir)
+                run["startup_s"][str(scale)] = startup
+                print(f"server ready in {startup}s")
+            try:
+                calls = endpoint_requests(base_url, images, uploads, args.save_batch)
+                for endpoint in endpoints:
+                    for concurrency in levels:
+                        if endpoint == "runInferenceTest":
+                            # stored predictions and GridFS copies outlive a level (and the server), images
+                            # sent before would be cache hits instead of inference
+                            uploads[:] = seed_data.upload_images(args.requests, upload_width, upload_height, rng)
+                        result = run_load(calls[endpoint], args.requests, concurrency)
+                        result.update({"scale": scale, "endpoint": endpoint, "concurrency": concurrency})
+                        run["results"].append(result)
+                        print(f"{endpoint:<18} c={concurrency:<3} p50 {result['p50_ms']} ms  p95 {result['p95_ms']} ms  "
+                              f"p99 {result['p99_ms']} ms  {result['throughput_rps']} req/s  errors {result['errors']}")
+            finally:
+                if process is not None:
+                    stop_server(process)
+
+    out = args.out or os.path.join(RESULTS_DIR, time.strftime("bench-%Y%m%d-%H%M%S.json"))
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(run, f, indent=2, default=str)
+    print(f"\nWrote {out}")
+
+    if args.baseline:
+        compare(run["results"], args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Synthetic data for the benchmarks: geotagged JPEGs in GridFS and detection documents shaped
+like the ones /saveResults writes. Only ever point this at a throwaway database (MONGO_DATABASE).
+"""
+import hashlib  # same sha256 metadata the upload path stores
+from io import BytesIO  # encoding JPEGs in memory
+import numpy as np  # random image content and coordinates
+from PIL import Image  # JPEG encoding with EXIF
+from app.detections import build_document  # same document layout /saveResults writes
+from app.db import reserve_cursor_range, release_cursor_range  # insertion cursor for /images?since=
+
+
+# synthetic flights are spread over this area (around State College, PA)
+CENTER_LAT = 40.79
+CENTER_LON = -77.86
+SPREAD_DEGREES = 0.05
+# class names of the shipped model (app/singleModel_0.0.1.pt) in its index order, so probabilities line up
+CLASSES = ["narrowleaf_cattail", "none", "phragmites", "purple_loosestrife"]
+
+
+def to_dms(value):
+    """Decimal degrees -> (degrees, minutes, seconds) as EXIF wants them."""
+    value = abs(value)
+    degrees = int(value)
+    minutes = int((value - degrees) * 60)
+    seconds = round((value - degrees - minutes / 60) * 3600, 4)
+    return (float(degrees), float(minutes), seconds)
+
+
+def synthetic_jpeg(rng, width, height, lat, lon, yaw, msl_alt, quality=85):
+    """A smooth random image (compresses roughly like a photo) with GPS position, yaw and altitude in its EXIF."""
+    small = rng.integers(0, 256, (max(1, height // 16), max(1, width // 16), 3), dtype=np.uint8)
+    image = Image.fromarray(small).resize((width, height), Image.BILINEAR)
+
+    exif = Image.Exif()
+    exif[0x8825] = {  # GPS IFD
+        1: "N" if lat >= 0 else "S",
+        2: to_dms(lat),
+        3: "E" if lon >= 0 else "W",
+        4: to_dms(lon),
+        5: 0,
+        6: float(msl_alt),
+        16: "T",
+        17: float(yaw),
+    }
+    buffer = BytesIO()
+    image.save(buffer, "JPEG", quality=quality, exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+def random_position(rng):
+    lat = CENTER_LAT + rng.uniform(-SPREAD_DEGREES, SPREAD_DEGREES)
+    lon = CENTER_LON + rng.uniform(-SPREAD_DEGREES, SPREAD_DEGREES)
+    return lat, lon
+
+
+def seed_images(fs, count, width, height, rng):
+    """
+    Stores count synthetic images in GridFS with the metadata the upload path adds.
+    Returns [(file_id, exif dict)].
+    """
+    seeded = []
+    for i in range(count):
+        lat, lon = random_position(rng)
+        yaw = float(rng.uniform(0, 360))
+        msl_alt = float(rng.uniform(340, 360))
+        file_bytes = synthetic_jpeg(rng, width, height, lat, lon, yaw, msl_alt)
+        exif = {"lat": lat, "lon": lon, "yaw": yaw, "msl_alt": msl_alt}
+        file_id = fs.put(file_bytes, filename=f"bench_{i:05d}.jpg", metadata={
+            "exif": exif,
+            "sha256": hashlib.sha256(file_bytes).hexdigest(),
+        })
+        seeded.append((file_id, exif))
+    return seeded
+
+
+def detection_doc(rng, file_id, exif):
+    """One detection document like /saveResults stores, at a random spot so the map has spread-out points."""
+    lat, lon = random_position(rng)
+    probabilities = rng.dirichlet(np.ones(len(CLASSES))).tolist()
+    return build_document(
+        file_id, f"bench_{file_id}.jpg", lat, lon,
+        yaw=exif["yaw"],
+        msl_alt=exif["msl_alt"],
+        predicted_class=CLASSES[int(np.argmax(probabilities))],
+        probabilities=probabilities,
+    )
+
+
+def seed_detections(collection, images, count, rng, batch_size=5000):
+    """Adds detection documents until the collection holds count of them (images are reused round-robin)."""
+    existing = collection.estimated_document_count()
+    for start in range(existing, count, batch_size):
+        docs = []
+        for i in range(start, min(count, start + batch_size)):
+            file_id, exif = images[i % len(images)]
+            docs.append(detection_doc(rng, file_id, exif))
+        seq_start = reserve_cursor_range(len(docs), collection.database)
+        for offset, doc in enumerate(docs):
+            doc["seq"] = seq_start + offset
+        try:
+            collection.insert_many(docs, ordered=False)
+        finally:
+            release_cursor_range(seq_start, collection.database)
+    return collection.estimated_document_count()
+
+
+def upload_images(count, width, height, rng):
+    """Unique JPEG bytes for upload requests (unique so the upload dedupe/prediction cache doesn't hide the work)."""
+    return [
+        synthetic_jpeg(rng, width, height, *random_position(rng), float(rng.uniform(0, 360)), 350.0)
+        for _ in range(count)
+    ]
@@ -0,0 +1,76 @@
+"""
+Measures how long a fresh process takes to import the web routes and to build the app, and which
+heavy libraries those steps pull in. Every measurement runs in a new interpreter so nothing is cached.
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --runs 5 --out benchmarks/results/startup.json
+"""
+import os       # environment for the measured processes
+import sys      # running the measurements with this interpreter
+import json     # machine-readable results
+import time     # result file names
+import argparse
+import subprocess  # one fresh interpreter per measurement
+import statistics  # median over runs
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ["torch", "ultralytics", "cv2", "numpy", "exifread", "onnxruntime", "openvino"]
+
+# each snippet prints {"seconds": ..., "loaded": [...]} for what it measured
+SNIPPETS = {
+    # what every map/tile/image request path needs
+    "import_routes": "import app.routes",
+    # the whole app without touching the model
+    "create_app_lazy_model": "import os; os.environ['MODEL_EAGER_LOAD'] = '0'; from app import create_app; create_app()",
+    # what a worker does at boot without preload (load + warmup)
+    "create_app_eager_model": "import os; os.environ['MODEL_EAGER_LOAD'] = '1'; from app import create_app; create_app()",
+}
+
+MEASURE = """
+import sys, time, json
+start = time.perf_counter()
+{snippet}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(name, runs):
+    seconds, loaded = [], []
+    for _ in range(runs):
+        code = MEASURE.format(snippet=SNIPPETS[name], heavy=HEAVY_MODULES)
+        output = subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, capture_output=True, text=True)
+        if output.returncode != 0:
+            return {"error": output.stderr.strip().splitlines()[-1] if output.stderr else "failed"}
+        result = json.loads(output.stdout.strip().splitlines()[-1])
+        seconds.append(result["seconds"])
+        loaded = result["loaded"]
+    return {
+        "median_s": round(statistics.median(seconds), 3),
+        "min_s": round(min(seconds), 3),
+        "runs": runs,
+        "heavy_modules_loaded": loaded,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import and app startup time.")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--only", default=",".join(SNIPPETS), help="which of " + ", ".join(SNIPPETS))
+    parser.add_argument("--out", default=None, help="results file (default benchmarks/results/startup-<time>.json)")
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.only.split(","):
+        results[name] = measure(name, args.runs)
+        print(f"{name:<24} {json.dumps(results[name])}")
+
+    out = args.out or os.path.join(REPO_ROOT, "benchmarks", "results", time.strftime("startup-%Y%m%d-%H%M%S.json"))
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w") as f:
+        json.dump({"started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "results": results}, f, indent=2)
+    print(f"Wrote {out}")
+
+
+if __name__ == "__main__":
+    main()
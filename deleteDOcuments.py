@@ -25,6 +25,10 @@ def delete_all_documents():
 
     result = collection.delete_many({})
     print(f" Deleted {result.deleted_count} documents from '{COLLECTION_NAME}'.")
+    # the /stats counts would still include them
+    db["detectionStats"].delete_many({})
+    # new collection version, so the app's cached /images responses and map tiles aren't served anymore
+    db["appMeta"].update_one({"_id": COLLECTION_NAME}, {"$inc": {"version": 1}}, upsert=True)
 
     client.close()
 
@@ -0,0 +1,134 @@
+# gunicorn picks this file up automatically from the working directory
+import gc
+import os
+import secrets
+import shutil
+import subprocess
+import sys
+import time
+import threading
+
+config_loaded_at = time.time()
+
+# Workers (and the inference process) write their metrics here so /metrics can add them up.
+# It has to be in the environment before any of them import prometheus_client. Only the master
+# clears it (on_starting), anything else loading this config must not wipe a running server's numbers.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/flask_metrics")
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+# GUNICORN_PRELOAD=1: build the app (and load the model) once in the master, workers get it copy-on-write
+# through fork instead of each importing torch and reading the weights (see create_app)
+preload_app = os.getenv("GUNICORN_PRELOAD", "0") == "1"
+
+# With INFERENCE_MODE=remote the web workers don't load torch or the model at all,
+# one inference process started here holds the only copy and serves them over a Unix socket.
+inference_process = None
+inference_stopping = threading.Event()
+if os.getenv("INFERENCE_MODE", "local") == "remote":
+    # the workers and the inference process inherit it from the master's environment, nothing else knows it
+    os.environ.setdefault("INFERENCE_AUTHKEY", secrets.token_hex(32))
+# how often the master checks that the inference process is still alive
+INFERENCE_CHECK_SECONDS = float(os.getenv("INFERENCE_CHECK_SECONDS", "2"))
+
+
+def start_inference_process(server):
+    """Starts the inference process and waits until it listens (or exits, which raises)."""
+    global inference_process
+    socket_path = os.getenv("INFERENCE_SOCKET", "/tmp/inference.sock")
+    if os.path.exists(socket_path):
+        os.remove(socket_path)  # left over from a previous run
+    inference_process = subprocess.Popen([sys.executable, "-m", "app.inference_server"])
+    # give the model time to load so the first requests don't fail
+    deadline = time.time() + float(os.getenv("INFERENCE_STARTUP_TIMEOUT", "120"))
+    while not os.path.exists(socket_path) and time.time() < deadline:
+        if inference_process.poll() is not None:
+            raise RuntimeError("Inference process exited during startup")
+        time.sleep(0.2)
+    server.log.info(f"Inference process {inference_process.pid} ready on {socket_path}")
+
+
+def monitor_inference_process(server):
+    """Restarts the inference process when it dies, so workers don't fail every request until a redeploy."""
+    backoff = INFERENCE_CHECK_SECONDS
+    while not inference_stopping.wait(INFERENCE_CHECK_SECONDS):
+        code = inference_process.poll()
+        if code is None:
+            continue
+        server.log.error(f"Inference process {inference_process.pid} exited with {code}, restarting it")
+        try:
+            start_inference_process(server)
+            backoff = INFERENCE_CHECK_SECONDS
+        except Exception as e:
+            # keep trying, but don't spin if the model can't load at all
+            server.log.error(f"Could not restart the inference process: {e}")
+            backoff = min(backoff * 2, 60)
+            inference_stopping.wait(backoff)
+
+
+def clear_metrics_dir():
+    """
+    Removes the numbers of a previous run. With preload the master already built the app (and
+    recorded its own metrics) before on_starting, so the master's files are kept.
+    """
+    metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    own_suffix = f"_{os.getpid()}.db"
+    for filename in os.listdir(metrics_dir):
+        path = os.path.join(metrics_dir, filename)
+        if filename.endswith(own_suffix):
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def on_starting(server):
+    clear_metrics_dir()
+    if os.getenv("INFERENCE_MODE", "local") != "remote":
+        return
+    start_inference_process(server)
+    threading.Thread(target=monitor_inference_process, args=(server,), daemon=True,
+                     name="inference-monitor").start()
+
+
+def when_ready(server):
+    server.log.info(f"Master ready in {time.time() - config_loaded_at:.2f}s (preload={preload_app})")
+    if preload_app:
+        # objects made so far (the model included) go into a generation the GC never scans,
+        # so collections in the workers don't write to, and un-share, those pages
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    worker.forked_at = time.time()
+
+
+def post_worker_init(worker):
+    # runs in the worker once the app is loaded (imported here, or inherited from the master with preload)
+    startup = time.time() - worker.forked_at
+    if preload_app:
+        from app.model_registry import registry
+        registry.warmup_loaded()
+        startup = time.time() - worker.forked_at
+    from app import metrics
+    metrics.APP_STARTUP.labels("worker").observe(startup)
+    worker.log.info(f"Worker {worker.pid} ready {startup:.2f}s after fork")
+
+
+def on_exit(server):
+    inference_stopping.set()
+    if inference_process is not None and inference_process.poll() is None:
+        inference_process.terminate()
+        inference_process.wait(timeout=10)
+
+
+def child_exit(server, worker):
+    # a dead worker's "live" gauges (models_loaded) shouldn't count any more
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,9 +1,17 @@
 from pymongo import MongoClient
-from bson import Binary  # For storing raw bytes in MongoDB
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from bson import Binary, ObjectId  # For storing raw bytes in MongoDB / GridFS ids picked before writing
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import argparse
+import gridfs
+from gridfs.errors import FileExists
+import hashlib
 import os
 import exifread
 import logging
 import socket
+import time
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -174,10 +182,185 @@ def get_images(test_mode=False):
 
 
 
+# EXIF lives in the JPEG's APP1 segment near the start of the file (max 64 KB)
+EXIF_HEADER_BYTES = 255 * 1024
+HASH_READ_BYTES = 1024 * 1024
+DEFAULT_CHECKPOINT_FILE = "ingest_checkpoint.txt"
+
+def parse_image_metadata(filepath):
+    """
+    Runs in a worker process: parses the EXIF header of one image and hashes the whole file.
+    Returns (filepath, exif dict with raw values, file size in bytes, sha256 hex digest)
+    or (filepath, None, 0, None) on failure.
+    """
+    try:
+        with open(filepath, 'rb') as f:
+            header = f.read(EXIF_HEADER_BYTES)
+            # same content hash the app keeps in GridFS metadata, so uploads of the same frame reuse this copy
+            digest = hashlib.sha256(header)
+            for chunk in iter(lambda: f.read(HASH_READ_BYTES), b""):
+                digest.update(chunk)
+        tags = exifread.process_file(BytesIO(header), details=False)
+        size = os.path.getsize(filepath)
+    except Exception as e:
+        logging.error(f"Error reading EXIF from {filepath}: {e}")
+        return filepath, None, 0, None
+
+    lat, lon = None, None
+    try:
+        if 'GPS GPSLatitude' in tags and 'GPS GPSLongitude' in tags:
+            lat = convert_to_degrees(tags['GPS GPSLatitude'], tags['GPS GPSLatitudeRef'].values)
+            lon = convert_to_degrees(tags['GPS GPSLongitude'], tags['GPS GPSLongitudeRef'].values)
+    except Exception as e:
+        logging.warning(f"Error extracting GPS data: {e}")
+
+    # same shape the Flask app stores in GridFS metadata, so /saveResults can reuse it
+    exif = {"lat": lat, "lon": lon, "yaw": extract_yaw(tags), "msl_alt": extract_altitude(tags)}
+    return filepath, exif, size, digest.hexdigest()
+
+def load_checkpoint(checkpoint_file):
+    """Paths that were fully ingested by an earlier run."""
+    if not os.path.exists(checkpoint_file):
+        return set()
+    with open(checkpoint_file, encoding="utf-8") as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+def store_image_file(db, fs, filepath, exif, sha256):
+    """
+    Puts one image in GridFS, reusing the file from an interrupted run, or any stored image with the
+    same content (uploaded through the app, or the same frame twice in the folder), if there is one.
+    """
+    existing = fs.find_one({"$or": [{"metadata.source_path": filepath}, {"metadata.sha256": sha256}]})
+    if existing is not None:
+        return existing._id
+    file_id = ObjectId()
+    try:
+        with open(filepath, 'rb') as f:
+            return fs.put(f, _id=file_id, filename=os.path.basename(filepath), contentType="image/jpeg",
+                          metadata={"exif": exif, "sha256": sha256, "source_path": filepath})
+    except (FileExists, DuplicateKeyError):
+        # the same content was stored at the same time, the app's unique sha256 index kept the other copy
+        db["fs.chunks"].delete_many({"files_id": file_id})
+        return fs.find_one({"metadata.sha256": sha256})._id
+
+def build_feature(file_id, filepath, exif):
+    """Detection document for one ingested image, built by the app itself so it matches /saveResults."""
+    from app.detections import build_document  # the app's current detection schema
+    lat = exif["lat"] - LATITUDE_OFFSET if exif["lat"] is not None else None
+    lon = exif["lon"] - LONGITUDE_OFFSET if exif["lon"] is not None else None
+    doc = build_document(file_id, os.path.basename(filepath), lat, lon, yaw=exif["yaw"], msl_alt=exif["msl_alt"])
+    # same _id as the GridFS file, so re-inserting after a crash is a harmless duplicate key
+    doc["_id"] = file_id
+    return doc
+
+def insert_features(db, collection, features):
+    """
+    Unordered bulk insert that ignores documents already inserted by an interrupted run.
+    Documents get insertion cursor values like /saveResults gives them, so the map's
+    /images?since= polling picks them up.
+    """
+    from app.db import reserve_cursor_range, release_cursor_range  # same cursor bookkeeping as the app
+    start = reserve_cursor_range(len(features), db)
+    for offset, feature in enumerate(features):
+        feature["seq"] = start + offset
+    try:
+        return len(collection.insert_many(features, ordered=False).inserted_ids)
+    except BulkWriteError as e:
+        other_errors = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+        if other_errors:
+            raise
+        return e.details.get("nInserted", 0)
+    finally:
+        release_cursor_range(start, db)
+
+def ingest_folder(folder, workers=None, batch_size=200, checkpoint_file=DEFAULT_CHECKPOINT_FILE):
+    """
+    Parallel, resumable ingest: EXIF is parsed in a process pool, images go to GridFS,
+    metadata is written with unordered insert_many batches and finished paths are checkpointed.
+    """
+    client = connect_to_mongodb()
+    db = client[DATABASE_NAME]
+    collection = db[COLLECTION_NAME]
+    fs = gridfs.GridFS(db)
+    db["fs.files"].create_index("metadata.source_path")
+    # same unique index the app creates, one GridFS copy per image content
+    db["fs.files"].create_index("metadata.sha256", name="sha256_unique", unique=True,
+                                partialFilterExpression={"metadata.sha256": {"$exists": True}})
+
+    done = load_checkpoint(checkpoint_file)
+    paths = []
+    for root, _, filenames in os.walk(folder):
+        for filename in filenames:
+            filepath = os.path.join(root, filename)
+            if allowed_file(filename) and filepath not in done:
+                paths.append(filepath)
+    paths.sort()
+    logging.info(f"{len(paths)} images to ingest from {folder} ({len(done)} already done)")
+
+    start_time = time.perf_counter()
+    files_done, bytes_done, inserted = 0, 0, 0
+    pending = []  # (filepath, exif, size, future for the GridFS put)
+
+    def flush(checkpoint):
+        nonlocal files_done, bytes_done, inserted
+        features, finished_paths = [], []
+        for filepath, exif, size, put_future in pending:
+            try:
+                features.append(build_feature(put_future.result(), filepath, exif))
+            except Exception as e:
+                logging.error(f"Error storing {filepath}: {e}")
+                continue
+            finished_paths.append(filepath)
+            files_done += 1
+            bytes_done += size
+        if features:
+            inserted += insert_features(db, collection, features)
+            # only checkpoint once the batch is safely in MongoDB
+            checkpoint.writelines(filepath + "\n" for filepath in finished_paths)
+            checkpoint.flush()
+        pending.clear()
+
+        elapsed = time.perf_counter() - start_time
+        logging.info(f"{files_done}/{len(paths)} images, {files_done / elapsed:.1f} files/s, "
+                     f"{bytes_done / elapsed / 1e6:.1f} MB/s")
+
+    with open(checkpoint_file, "a", encoding="utf-8") as checkpoint, \
+            ProcessPoolExecutor(max_workers=workers) as parse_pool, \
+            ThreadPoolExecutor(max_workers=8) as put_pool:
+        for filepath, exif, size, sha256 in parse_pool.map(parse_image_metadata, paths, chunksize=16):
+            if exif is None:
+                continue
+            put_future = put_pool.submit(store_image_file, db, fs, filepath, exif, sha256)
+            pending.append((filepath, exif, size, put_future))
+            if len(pending) >= batch_size:
+                flush(checkpoint)
+        if pending:
+            flush(checkpoint)
+
+    elapsed = time.perf_counter() - start_time
+    logging.info(f"Ingested {files_done} images ({inserted} new documents, {bytes_done / 1e6:.1f} MB) "
+                 f"in {elapsed:.1f}s: {files_done / max(elapsed, 1e-9):.1f} files/s, "
+                 f"{bytes_done / max(elapsed, 1e-9) / 1e6:.1f} MB/s")
+    client.close()
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load drone images into MongoDB.")
+    parser.add_argument("--folder", default=UPLOAD_FOLDERS, help="folder to scan for .jpg/.jpeg images")
+    parser.add_argument("--workers", type=int, default=None, help="EXIF parsing processes (default: CPU count)")
+    parser.add_argument("--batch-size", type=int, default=200, help="documents per insert_many")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT_FILE, help="file that records finished images")
+    parser.add_argument("--legacy", action="store_true", help="old serial ingest that stores images inline "
+                             "(its documents have no insertion cursor, open maps need a full reload to show them)")
+    args = parser.parse_args()
+
     logging.info("Starting image processing...")
 
-    test_mode = False
-    get_images(test_mode)
+    if args.legacy:
+        test_mode = False
+        get_images(test_mode)
+    else:
+        ingest_folder(args.folder, workers=args.workers, batch_size=args.batch_size,
+                      checkpoint_file=args.checkpoint)
 
     logging.info("Image processing completed.")